@@ -0,0 +1,317 @@
+# Testes de carga, de memória e de desempenho da criptografia da camada de dados do todo_app_v3.
+# Uso: python stress_test_v3.py --teste-carga | --teste-memoria | --benchmark-cifra
+# Cada modo sai com código 0 se passou e 1 se falhou (para servir de portão antes de uma mudança).
+import gc
+import multiprocessing
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+from todo_app_v3 import TaskManager
+
+# Sobrecusto máximo aceito para carregar e exibir a lista cifrada, em relação ao caminho sem criptografia.
+ENCRYPTION_OVERHEAD_BUDGET = 0.25
+
+# --- Desempenho da Criptografia ---
+def benchmark_encryption(task_count=5000, rendered_rows=50, repeats=21):
+    """
+    Compara o tempo de carregar a lista e "renderizar" (ler título e descrição) as primeiras
+    'rendered_rows' tarefas com e sem criptografia. As medições dos dois bancos são intercaladas (a
+    ordem alterna a cada rodada), com o cache de tarefas vazio e o coletor de lixo desligado; o sobrecusto
+    é a mediana das razões de cada rodada, para que ruído da máquina afete os dois lados por igual.
+    O custo de decifrar uma linha e a derivação da chave, feita uma vez por sessão, são medidos à parte.
+    Retorna o sobrecusto relativo, que deve ficar abaixo de ENCRYPTION_OVERHEAD_BUDGET.
+    """
+    managers, setup_times = {}, {}
+    timings = {"texto puro": [], "cifrado": []}
+    render_timings = []
+    with tempfile.TemporaryDirectory() as directory:
+        for label, passphrase in (("texto puro", None), ("cifrado", "benchmark")):
+            started = time.perf_counter()
+            manager = managers[label] = TaskManager(os.path.join(directory, f"{label}.db"), passphrase=passphrase)
+            setup_times[label] = time.perf_counter() - started
+            with manager.conn:
+                rows = [(i, manager._seal(f"Tarefa {i}", "title", i), manager._seal("Descrição da tarefa " * 20, "description", i),
+                         "Média", manager._now()) for i in range(1, task_count + 1)]
+                manager.conn.executemany(
+                    "INSERT INTO tasks (id, title, description, priority, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+        gc.disable()
+        try:
+            for round_number in range(repeats):
+                labels = list(timings) if round_number % 2 == 0 else list(reversed(timings))
+                for label in labels:
+                    manager = managers[label]
+                    manager.task_cache.validate(None) # Mede a leitura a frio, sem reaproveitar títulos já decifrados
+                    started = time.perf_counter()
+                    tasks, _, _ = manager.get_visible_tree(set(), limit=task_count)
+                    loaded = time.perf_counter()
+                    for task, _ in tasks[:rendered_rows]:
+                        task.title, task.description_preview
+                    finished = time.perf_counter()
+                    timings[label].append(finished - started)
+                    if label == "cifrado":
+                        render_timings.append(finished - loaded)
+                gc.collect()
+        finally:
+            gc.enable()
+            for manager in managers.values():
+                manager.close_connection()
+    plain, encrypted = statistics.median(timings["texto puro"]), statistics.median(timings["cifrado"])
+    overhead = statistics.median(e / p for p, e in zip(timings["texto puro"], timings["cifrado"])) - 1
+    print(f"Carregar {task_count} tarefas e exibir {rendered_rows} (mediana de {repeats}): texto puro {plain * 1000:.1f} ms, "
+          f"cifrado {encrypted * 1000:.1f} ms ({overhead:+.1%}; limite {ENCRYPTION_OVERHEAD_BUDGET:.0%})")
+    print(f"Decifrar título e prévia: {statistics.median(render_timings) / rendered_rows * 1e6:.1f} µs por linha")
+    print(f"Derivação da chave (uma vez por sessão): {setup_times['cifrado'] - setup_times['texto puro']:.2f} s")
+    return overhead
+
+# --- Teste de Memória (modo de memória limitada) ---
+MEMORY_TEST_SIZES = (20_000, 400_000)
+MEMORY_TEST_CAP_KIB = 4 * 1024
+MEMORY_TEST_GROWTH = 0.25 # Quanto o pico do banco maior pode passar do pico do menor
+
+def _fill_memory_test_db(manager, task_count):
+    """Tarefas sintéticas: a primeira tem 10% das demais como filhas e uma a cada dez tem a tag 'lote'."""
+    with manager.conn:
+        children = task_count // 10
+        manager.conn.executemany(
+            "INSERT INTO tasks (title, description, priority, created_at, is_completed, parent_id) VALUES (?, ?, ?, ?, ?, ?)",
+            ((f"Tarefa {i}", "Descrição " * 30, "Média", manager._now(), int(i % 3 == 0), 1 if 0 < i <= children else None)
+             for i in range(task_count)))
+        manager.conn.execute("UPDATE tasks SET subtree_total = ? WHERE id = 1", (children,))
+        manager.conn.execute("INSERT INTO tags (name) VALUES ('lote')")
+        manager.conn.execute("INSERT INTO task_tags (task_id, tag_id) SELECT id, (SELECT id FROM tags) FROM tasks WHERE id % 10 = 0")
+
+def _measure_memory_peak(manager, pages):
+    """Pico de memória (tracemalloc, em bytes) ao paginar a árvore, os filhos, o filtro de tags e percorrer tudo."""
+    tracemalloc.start()
+    try:
+        key, child_key = None, None
+        for _ in range(pages):
+            _, key, _ = manager.get_visible_tree({1}, after=key)
+            _, _, child_keys = manager.get_visible_tree({1}, child_after={1: child_key} if child_key else None)
+            child_key = child_keys.get(1)
+            if not key or not child_key:
+                break
+        key = None
+        for _ in range(pages):
+            _, key = manager.get_tasks_by_tags(["lote"], after=key)
+            if not key:
+                break
+        streamed = sum(1 for _ in manager.iter_tasks())
+        return tracemalloc.get_traced_memory()[1], streamed
+    finally:
+        tracemalloc.stop()
+
+def memory_test(sizes=MEMORY_TEST_SIZES, pages=20, cap_kib=MEMORY_TEST_CAP_KIB):
+    """
+    Verifica o modo de memória limitada: para cada tamanho de banco, mede o pico de memória do Python ao
+    paginar as listagens e ao percorrer todas as tarefas com iter_tasks. Falha se o pico crescer com o
+    tamanho do banco (mais que MEMORY_TEST_GROWTH) ou passar de 'cap_kib'. O cache do próprio SQLite fica
+    fora da medição; ele é limitado por SQLITE_CACHE_KIB. Retorna True se o limite foi respeitado.
+    """
+    peaks = []
+    with tempfile.TemporaryDirectory() as directory:
+        for task_count in sizes:
+            manager = TaskManager(os.path.join(directory, f"memoria-{task_count}.db"))
+            _fill_memory_test_db(manager, task_count)
+            manager.task_cache.validate(None)
+            peak, streamed = _measure_memory_peak(manager, pages)
+            manager.close_connection()
+            peaks.append(peak)
+            print(f"{task_count} tarefas ({streamed} percorridas): pico de {peak / 1024:.0f} KiB")
+    failures = []
+    if max(peaks) > cap_kib * 1024:
+        failures.append(f"pico acima do limite de {cap_kib} KiB")
+    if peaks[-1] > peaks[0] * (1 + MEMORY_TEST_GROWTH):
+        failures.append(f"o pico cresceu {peaks[-1] / peaks[0] - 1:.0%} com o tamanho do banco")
+    for failure in failures:
+        print(f"FALHA: {failure}")
+    print("Memória limitada OK" if not failures else f"{len(failures)} verificação(ões) falhou(aram)")
+    return not failures
+
+# --- Teste de Carga (concorrência) ---
+STRESS_SHARED_TAGS = ["casa", "trabalho", "urgente"]
+STRESS_OPERATIONS = {"adicionar": 4, "subtarefa": 2, "concluir": 3, "editar": 2, "excluir": 1, "ler": 3}
+
+def _stress_worker(manager, worker, operations, seed):
+    """
+    Executa 'operations' operações aleatórias (sorteadas com 'seed') sobre as próprias tarefas do
+    trabalhador e devolve o modelo esperado delas: {id: {...}}, com 'deleted' para as excluídas.
+    As tags compartilhadas fazem os trabalhadores disputarem as mesmas linhas de 'tags'.
+    """
+    rng = random.Random(seed)
+    own_tag = f"w{worker}"
+    model = {}
+    names, weights = zip(*STRESS_OPERATIONS.items())
+    for number in range(operations):
+        live = [task_id for task_id, expected in model.items() if not expected["deleted"]]
+        operation = rng.choices(names, weights)[0] if live else "adicionar"
+        if operation in ("adicionar", "subtarefa"):
+            parent_id = rng.choice(live) if operation == "subtarefa" else None
+            tags = sorted({own_tag, rng.choice(STRESS_SHARED_TAGS)})
+            priority = rng.choice(["Alta", "Média", "Baixa"])
+            title = f"{own_tag}-{number}"
+            task_id = manager.add_task(title, "", priority, None, tags, parent_id)
+            model[task_id] = {"title": title, "priority": priority, "done": False, "parent_id": parent_id,
+                              "tags": tags, "deleted": False}
+        elif operation in ("concluir", "editar"):
+            task_id = rng.choice(live)
+            task = manager.get_tasks([task_id])[0]
+            expected = model[task_id]
+            if operation == "concluir":
+                task.is_completed = expected["done"] = not task.is_completed
+            else:
+                task.title = expected["title"] = f"{expected['title']}*"
+                task.priority = expected["priority"] = rng.choice(["Alta", "Média", "Baixa"])
+                task.tags = expected["tags"] = sorted({own_tag, rng.choice(STRESS_SHARED_TAGS)})
+            manager.update_task(task)
+        elif operation == "excluir":
+            removed = {rng.choice(live)}
+            while True: # A subárvore inteira vai para o arquivo
+                children = {task_id for task_id, expected in model.items() if expected["parent_id"] in removed} - removed
+                if not children:
+                    break
+                removed |= children
+            manager.delete_task(min(removed))
+            for task_id in removed:
+                model[task_id]["deleted"] = True
+        else:
+            manager.get_visible_tree(set())
+            manager.get_tasks_by_tags([own_tag])
+    return model
+
+def _stress_process(db_filename, worker, operations, seed):
+    """Trabalhador em outro processo: abre o próprio TaskManager sobre o mesmo arquivo."""
+    manager = TaskManager(db_filename)
+    try:
+        return _stress_worker(manager, worker, operations, seed), manager.lock_stats
+    finally:
+        manager.close_connection()
+
+def _check_stress_invariants(manager, models):
+    """Compara o banco com os modelos dos trabalhadores e com os contadores derivados. Retorna as falhas."""
+    failures = []
+    conn = manager.conn
+    expected_tasks = {task_id: expected for model in models for task_id, expected in model.items()}
+    rows = {row["id"]: row for row in conn.execute("SELECT id, title, priority, is_completed, parent_id FROM tasks")}
+    archived = {row["id"] for row in conn.execute(f"SELECT id FROM {manager.archive_table}")}
+    tags = {}
+    for row in conn.execute("SELECT tt.task_id, tags.name FROM task_tags tt JOIN tags ON tags.id = tt.tag_id"):
+        tags.setdefault(row["task_id"], []).append(row["name"])
+    # Nenhuma gravação perdida: cada tarefa está exatamente como o seu trabalhador a deixou.
+    for task_id, expected in expected_tasks.items():
+        if expected["deleted"]:
+            if task_id in rows or task_id not in archived:
+                failures.append(f"tarefa {task_id}: excluída, mas não está (só) no arquivo")
+            continue
+        row = rows.get(task_id)
+        actual = row and {"title": row["title"], "priority": row["priority"], "done": bool(row["is_completed"]),
+                          "parent_id": row["parent_id"], "tags": sorted(tags.get(task_id, []))}
+        wanted = {key: value for key, value in expected.items() if key != "deleted"}
+        if actual != wanted:
+            failures.append(f"tarefa {task_id}: esperado {wanted}, encontrado {actual}")
+    if len(rows) + len(archived) != len(expected_tasks):
+        failures.append(f"{len(rows)} ativas + {len(archived)} arquivadas, mas {len(expected_tasks)} foram criadas")
+    # Contadores mantidos de forma incremental conferem com uma contagem completa.
+    drifted = conn.execute("""
+        WITH RECURSIVE descendants (root, id, is_completed) AS (
+            SELECT t.id, c.id, c.is_completed FROM tasks t JOIN tasks c ON c.parent_id = t.id
+            UNION ALL SELECT d.root, c.id, c.is_completed FROM descendants d JOIN tasks c ON c.parent_id = d.id
+        )
+        SELECT t.id FROM tasks t LEFT JOIN (
+            SELECT root, COUNT(*) AS total, SUM(is_completed) AS done FROM descendants GROUP BY root
+        ) d ON d.root = t.id
+        WHERE t.subtree_total != COALESCE(d.total, 0) OR t.subtree_done != COALESCE(d.done, 0)
+    """).fetchall()
+    if drifted:
+        failures.append(f"contadores de subtarefas divergentes em {[row['id'] for row in drifted]}")
+    open_summary = conn.execute("SELECT COALESCE(SUM(open_count), 0) FROM open_by_due").fetchone()[0]
+    open_tasks = conn.execute("SELECT COUNT(*) FROM tasks WHERE is_completed = 0").fetchone()[0]
+    if open_summary != open_tasks:
+        failures.append(f"resumo por prazo indica {open_summary} pendentes, a tabela tem {open_tasks}")
+    created = conn.execute("SELECT COALESCE(SUM(created), 0) FROM daily_stats").fetchone()[0]
+    if created != len(expected_tasks):
+        failures.append(f"estatísticas registram {created} tarefas criadas, esperado {len(expected_tasks)}")
+    orphans = conn.execute(f"""
+        SELECT COUNT(*) FROM task_tags WHERE task_id NOT IN (SELECT id FROM tasks UNION SELECT id FROM {manager.archive_table})
+            OR tag_id NOT IN (SELECT id FROM tags)
+    """).fetchone()[0]
+    if orphans:
+        failures.append(f"{orphans} vínculos de tag apontam para tarefas ou tags inexistentes")
+    integrity = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    if integrity != "ok":
+        failures.append(f"integrity_check: {integrity}")
+    return failures
+
+def stress_test(threads=8, processes=2, operations=200, seed=None):
+    """
+    Teste de carga da camada de dados: 'threads' trabalhadores compartilhando um TaskManager e 'processes'
+    processos com o seu próprio, todos sobre o mesmo banco, com misturas aleatórias de operações.
+    Ao final confere os invariantes e mostra a vazão e a disputa pelo lock de escrita. A semente é
+    impressa para que uma falha possa ser reproduzida. Retorna True se nenhum invariante foi violado.
+    """
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    with tempfile.TemporaryDirectory() as directory:
+        db_filename = os.path.join(directory, "carga.db")
+        manager = TaskManager(db_filename)
+        models, errors = [None] * threads, []
+
+        def run_thread(worker):
+            try:
+                models[worker] = _stress_worker(manager, worker, operations, seed + worker)
+            except Exception as error:
+                errors.append(f"thread {worker}: {error!r}")
+
+        started = time.perf_counter()
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_stress_process, db_filename, threads + index, operations, seed + threads + index)
+                       for index in range(processes)]
+            workers = [threading.Thread(target=run_thread, args=(worker,)) for worker in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            stats = [dict(manager.lock_stats)]
+            for index, future in enumerate(futures):
+                try:
+                    model, process_stats = future.result()
+                    models.append(model)
+                    stats.append(process_stats)
+                except Exception as error:
+                    errors.append(f"processo {index}: {error!r}")
+        elapsed = time.perf_counter() - started
+
+        failures = errors + _check_stress_invariants(manager, [model for model in models if model is not None])
+        manager.close_connection()
+
+    total_operations = (threads + processes) * operations
+    transactions = sum(stat["transactions"] for stat in stats)
+    contended = sum(stat["contended"] for stat in stats)
+    wait = sum(stat["wait_seconds"] for stat in stats)
+    print(f"Semente {seed}: {threads} threads + {processes} processos, {total_operations} operações "
+          f"em {elapsed:.2f} s ({total_operations / elapsed:.0f} op/s)")
+    print(f"Transações de escrita: {transactions}, com espera pelo lock: {contended} "
+          f"({contended / max(transactions, 1):.0%}); espera média {wait / max(transactions, 1) * 1000:.2f} ms, "
+          f"máxima {max(stat['max_wait_seconds'] for stat in stats) * 1000:.1f} ms")
+    for failure in failures:
+        print(f"FALHA: {failure}")
+    print("Invariantes OK" if not failures else f"{len(failures)} invariante(s) violado(s)")
+    return not failures
+
+# --- Ponto de Entrada ---
+if __name__ == "__main__":
+    if "--benchmark-cifra" in sys.argv:
+        sys.exit(0 if benchmark_encryption() <= ENCRYPTION_OVERHEAD_BUDGET else 1)
+    if "--teste-memoria" in sys.argv:
+        sys.exit(0 if memory_test() else 1)
+    if "--teste-carga" in sys.argv:
+        # Portão para mudanças de concorrência: sai com código 1 se algum invariante for violado.
+        sys.exit(0 if stress_test() else 1)
+    print("Uso: python stress_test_v3.py --teste-carga | --teste-memoria | --benchmark-cifra")
+    sys.exit(2)
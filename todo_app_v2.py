@@ -1,6 +1,8 @@
 import customtkinter as ctk
 import json
 import os
+import hashlib
+import threading
 from tkinter import messagebox
 from datetime import datetime, date
 
@@ -8,6 +10,7 @@ from datetime import datetime, date
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 FILENAME = "tasks_v2.json"
+AUTOSAVE_DELAY_MS = 2000 # Alterações feitas dentro deste intervalo são gravadas juntas, em uma única escrita
 
 class Task:
     """
@@ -47,10 +50,15 @@ class Task:
 class TaskManager:
     """
     Gerencia a lógica de negócios e a persistência das tarefas.
+    Cada alteração agenda um salvamento automático em segundo plano (ver schedule_save).
     """
     def __init__(self, filename=FILENAME):
         self.filename = filename
         self.tasks = self.load_tasks()
+        self._lock = threading.Lock() # Protege self.tasks entre a interface e a thread de salvamento
+        self._write_lock = threading.Lock()
+        self._save_timer = None
+        self._saved_digest = hashlib.sha256(self._serialize()).digest()
 
     def load_tasks(self):
         """Carrega as tarefas do arquivo JSON."""
@@ -63,34 +71,90 @@ class TaskManager:
         except (json.JSONDecodeError, IOError):
             return []
 
+    def _serialize(self):
+        """Gera o conteúdo do arquivo a partir de uma cópia da lista, tirada com a trava."""
+        with self._lock:
+            snapshot = [task.to_dict() for task in self.tasks]
+        return json.dumps(snapshot, indent=4, ensure_ascii=False).encode("utf-8")
+
     def save_tasks(self):
-        """Salva a lista atual de tarefas no arquivo JSON."""
-        with open(self.filename, "w", encoding="utf-8") as f:
-            json.dump([task.to_dict() for task in self.tasks], f, indent=4, ensure_ascii=False)
+        """
+        Salva a lista atual de tarefas no arquivo JSON de forma atômica (arquivo temporário + fsync + rename),
+        para que uma queda no meio da escrita nunca deixe o arquivo corrompido. Se o conteúdo for igual ao
+        do último salvamento, nada é escrito.
+        """
+        with self._write_lock:
+            # A cópia é tirada já com a trava de escrita: um salvamento atrasado nunca grava um estado
+            # mais antigo por cima de um mais novo (ex.: o automático logo depois do salvamento ao fechar).
+            data = self._serialize()
+            digest = hashlib.sha256(data).digest()
+            if digest == self._saved_digest:
+                return
+            temp_filename = self.filename + ".tmp"
+            with open(temp_filename, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_filename, self.filename)
+            if os.name == "posix": # Garante que a renomeação também foi gravada no disco
+                dir_fd = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+                try:
+                    os.fsync(dir_fd)
+                finally:
+                    os.close(dir_fd)
+            self._saved_digest = digest
+
+    def schedule_save(self):
+        """Agenda um salvamento em segundo plano; as alterações seguintes, até ele acontecer, entram na mesma escrita."""
+        with self._lock:
+            if self._save_timer is None:
+                self._save_timer = threading.Timer(AUTOSAVE_DELAY_MS / 1000, self._autosave)
+                self._save_timer.daemon = True
+                self._save_timer.start()
+
+    def cancel_autosave(self):
+        """Cancela o salvamento automático agendado (ao fechar, quem salva é o próprio on_closing)."""
+        with self._lock:
+            if self._save_timer is not None:
+                self._save_timer.cancel()
+                self._save_timer = None
+
+    def _autosave(self):
+        with self._lock:
+            self._save_timer = None
+        self.save_tasks()
 
     def add_task(self, title, description, priority, due_date, category):
         """Adiciona uma nova tarefa."""
         if title:
             task = Task(title, description, priority, due_date, category)
-            self.tasks.append(task)
+            with self._lock:
+                self.tasks.append(task)
+            self.schedule_save()
             return task
         return None
     
     def update_task(self, task, new_title, new_desc, new_priority, new_due_date, new_category):
         """Atualiza os dados de uma tarefa existente."""
-        task.title = new_title
-        task.description = new_desc
-        task.priority = new_priority
-        task.due_date = new_due_date
-        task.category = new_category
+        with self._lock:
+            task.title = new_title
+            task.description = new_desc
+            task.priority = new_priority
+            task.due_date = new_due_date
+            task.category = new_category
+        self.schedule_save()
 
     def delete_task(self, task_to_delete):
         """Remove uma tarefa da lista."""
-        self.tasks.remove(task_to_delete)
+        with self._lock:
+            self.tasks.remove(task_to_delete)
+        self.schedule_save()
 
     def toggle_task_completion(self, task_to_toggle):
         """Alterna o estado de 'concluída' de uma tarefa."""
-        task_to_toggle.is_completed = not task_to_toggle.is_completed
+        with self._lock:
+            task_to_toggle.is_completed = not task_to_toggle.is_completed
+        self.schedule_save()
 
     def get_all_categories(self):
         """Retorna uma lista de todas as categorias únicas."""
@@ -366,7 +430,8 @@ class App(ctk.CTk):
 
 
     def on_closing(self):
-        """Salva as tarefas antes de fechar a aplicação."""
+        """Salva o que ainda não foi gravado pelo salvamento automático antes de fechar a aplicação."""
+        self.task_manager.cancel_autosave()
         self.task_manager.save_tasks()
         self.destroy()
 
@@ -1,38 +1,413 @@
 import customtkinter as ctk
 import sqlite3
+import json
 import os
+import threading
+import calendar
+import glob
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import hmac
+import sys
+import tempfile
+import time
 from tkinter import messagebox
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
 DB_FILENAME = "tasks.db"
+ARCHIVE_DB_FILENAME = None # Ex: "tasks_archive.db" para guardar o histórico em um arquivo separado
+ARCHIVE_AFTER_DAYS = 30
+MAINTENANCE_INTERVAL_MS = 10 * 60 * 1000
+INCREMENTAL_VACUUM_PAGES = 256
+# A coluna legada 'category' só existe para migração: as categorias agora são tags (tabelas 'tags' e 'task_tags').
+TASK_COLUMNS = ("id, title, description, priority, due_date, is_completed, completed_at, "
+                "parent_id, subtree_total, subtree_done, created_at, score")
+# Pesos da visão "Próximas": pontos por prioridade, por dia a menos até o prazo e por dia de idade da tarefa.
+# O peso de cada tag (tags.weight) é somado à pontuação. Tarefas sem prazo contam como se vencessem
+# NO_DUE_DATE_HORIZON_DAYS dias depois de criadas.
+RANKING_WEIGHTS = {"priority": {"Alta": 30.0, "Média": 15.0, "Baixa": 0.0}, "deadline_per_day": 2.0, "age_per_day": 0.5}
+NO_DUE_DATE_HORIZON_DAYS = 30
+NEXT_UP_LIMIT = 20
+# Frequências de repetição (código gravado no banco -> rótulo na interface) e janela de ocorrências exibidas.
+RECURRENCE_LABELS = {"diaria": "Diária", "semanal": "Semanal", "mensal": "Mensal"}
+RECURRENCE_WINDOW_DAYS = 14
+STATS_WINDOW_DAYS = 30
+# As listas trazem só o início da descrição; o texto completo é lido ao expandir a tarefa ou abrir a edição.
+DESCRIPTION_PREVIEW_LENGTH = 200
+# Modo de memória limitada: a lista é exibida em páginas, as linhas são lidas em lotes e só as
+# tarefas vistas mais recentemente ficam em memória, não importa quantas existam no banco.
+PAGE_SIZE = 50
+TASK_CACHE_SIZE = 500
+FETCH_BATCH_SIZE = 256
+SQLITE_CACHE_KIB = 8 * 1024
+
+# Backups a quente (API de backup do SQLite), feitos em segundo plano em passos de BACKUP_PAGES_PER_STEP páginas.
+BACKUP_DIRECTORY = "backups"
+BACKUP_INTERVAL_MS = 60 * 60 * 1000
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_PAUSE_SECONDS = 0.005
+BACKUP_KEEP_LAST = 5 # Rotação: os mais recentes sempre ficam...
+BACKUP_KEEP_DAILY = 14 # ...e, além deles, o último de cada um dos últimos N dias
+BACKUP_ATTEMPTS = 5 # Com banco de arquivo anexado, a cópia é refeita se alguém gravou no meio dela
+
+# Concorrência: cada thread usa a sua conexão e as gravações começam com BEGIN IMMEDIATE.
+BUSY_TIMEOUT_SECONDS = 30
+LOCK_WAIT_THRESHOLD_SECONDS = 0.001 # Esperas maiores que isso contam como disputa pelo lock de escrita
+
+# Criptografia opcional de título e descrição: ativada quando há uma senha (variável de ambiente abaixo).
+PASSPHRASE_ENV_VAR = "TODO_APP_PASSPHRASE"
+KEY_DERIVATION_ITERATIONS = 600_000
+CIPHER_CHUNK_SIZE = 4096
 
 class Task:
     """
     Representa uma única tarefa. Agora inclui o 'id' do banco de dados.
     """
-    def __init__(self, id, title, description, priority="Média", due_date=None, category="Geral", is_completed=False):
+    def __init__(self, id, title, description, priority="Média", due_date=None, tags=None, is_completed=False,
+                 completed_at=None, parent_id=None, subtree_total=0, subtree_done=0, created_at=None, score=None,
+                 recurrence=None, cipher=None, description_truncated=False):
         self.id = id
+        # Com criptografia, título e descrição chegam cifrados (bytes) e só são decifrados no primeiro acesso.
+        self.cipher = cipher
         self.title = title
         self.description = description
+        # Vindo de uma listagem, 'description' pode ser só o início do texto (ver TaskManager.load_description).
+        self.description_truncated = description_truncated
         self.priority = priority
         self.due_date = due_date
-        self.category = category
+        self.tags = list(tags or [])
         self.is_completed = is_completed
+        self.completed_at = completed_at
+        self.parent_id = parent_id
+        # Contadores de descendentes (todos os níveis), mantidos pelo TaskManager a cada alteração.
+        self.subtree_total = subtree_total
+        self.subtree_done = subtree_done
+        self.created_at = created_at
+        self.score = score
+        # Regra de repetição: None ou (frequência, intervalo), ex.: ("semanal", 2) = a cada 2 semanas.
+        self.recurrence = recurrence
+        # Dia do mês em que uma série mensal vence (ex.: 31), lido junto com a regra em _attach_details.
+        self.anchor_day = None
+
+    @property
+    def title(self):
+        if isinstance(self._title, bytes):
+            self._title = self.cipher.decrypt(self._title, context=FieldCipher.context("title", self.id))
+        return self._title
+
+    @title.setter
+    def title(self, value):
+        self._title = value
+
+    @property
+    def description(self):
+        if isinstance(self._description, bytes):
+            self._description = self.cipher.decrypt(self._description, complete=not self.description_truncated,
+                                                    context=FieldCipher.context("description", self.id))
+        return self._description
+
+    @description.setter
+    def description(self, value):
+        self._description = value
+        self.description_truncated = False
+
+    @property
+    def description_preview(self):
+        """Início da descrição, com reticências quando o texto continua."""
+        text = self.description or ""
+        if self.description_truncated or len(text) > DESCRIPTION_PREVIEW_LENGTH:
+            return text[:DESCRIPTION_PREVIEW_LENGTH].rstrip() + "…"
+        return text
+
+    @property
+    def has_subtasks(self):
+        return self.subtree_total > 0
+
+    @property
+    def progress(self):
+        """Percentual de subtarefas concluídas (0 a 100)."""
+        if not self.subtree_total:
+            return 0
+        return round(100 * self.subtree_done / self.subtree_total)
+
+    @staticmethod
+    def from_row(row, cipher=None):
+        """Cria um objeto Task a partir de uma linha do banco (sqlite3.Row)."""
+        truncated = "description_truncated" in row.keys() and bool(row["description_truncated"])
+        return Task(cipher=cipher, description_truncated=truncated, id=row["id"], title=row["title"], description=row["description"], priority=row["priority"],
+                    due_date=row["due_date"], is_completed=bool(row["is_completed"]),
+                    completed_at=row["completed_at"], parent_id=row["parent_id"],
+                    subtree_total=row["subtree_total"], subtree_done=row["subtree_done"],
+                    created_at=row["created_at"], score=row["score"])
+
+class FieldCipher:
+    """
+    Cifra autenticada de campos de texto usando só a biblioteca padrão. O texto é dividido em blocos de
+    CIPHER_CHUNK_SIZE bytes; cada bloco é combinado (XOR) com um fluxo de chave SHAKE-256 e recebe uma
+    etiqueta HMAC-SHA256 (16 bytes) sobre o contexto, o nonce, o índice do bloco e a marca de último bloco,
+    o que impede alterar, reordenar ou truncar blocos. O contexto (coluna e ID da tarefa, ver context()) é
+    obrigatório na decifragem: um valor copiado para outra tarefa ou outra coluna é rejeitado.
+    A chave é derivada da senha uma única vez (PBKDF2).
+    Formato: MAGIC + nonce (16 bytes) + [bloco cifrado + etiqueta]...
+    """
+    MAGIC = b"TDE2"
+    LEGACY_MAGIC = b"TDE1" # Formato anterior, sem contexto: só é lido para a conversão (ver TaskManager)
+    NONCE_SIZE = 16
+    TAG_SIZE = 16
+    HEADER_SIZE = len(MAGIC) + NONCE_SIZE
+
+    def __init__(self, passphrase, salt):
+        key = hashlib.pbkdf2_hmac("sha256", passphrase.encode("utf-8"), salt, KEY_DERIVATION_ITERATIONS, dklen=64)
+        self.encryption_key, self.mac_key = key[:32], key[32:]
+
+    def _keystream(self, nonce, index, size):
+        return hashlib.shake_256(self.encryption_key + nonce + index.to_bytes(8, "big")).digest(size)
+
+    @staticmethod
+    def context(column, task_id):
+        """Dados associados de um campo: a etiqueta só confere na mesma coluna da mesma tarefa."""
+        return f"{column}:{task_id}".encode("utf-8")
+
+    def _tag(self, nonce, index, is_last, ciphertext, context):
+        message = nonce + index.to_bytes(8, "big") + (b"\x01" if is_last else b"\x00") + ciphertext
+        if context is not None: # None só no formato antigo
+            message = len(context).to_bytes(4, "big") + context + message
+        return hmac.new(self.mac_key, message, hashlib.sha256).digest()[:self.TAG_SIZE]
+
+    @staticmethod
+    def _xor(data, keystream):
+        return (int.from_bytes(data, "big") ^ int.from_bytes(keystream, "big")).to_bytes(len(data), "big")
+
+    def encrypt(self, text, context):
+        """Cifra um texto ligado ao 'context' informado (None continua None)."""
+        if text is None:
+            return None
+        data = text.encode("utf-8")
+        nonce = os.urandom(self.NONCE_SIZE)
+        chunks = [data[start:start + CIPHER_CHUNK_SIZE] for start in range(0, len(data), CIPHER_CHUNK_SIZE)] or [b""]
+        output = [self.MAGIC, nonce]
+        for index, chunk in enumerate(chunks):
+            ciphertext = self._xor(chunk, self._keystream(nonce, index, len(chunk)))
+            output += [ciphertext, self._tag(nonce, index, index == len(chunks) - 1, ciphertext, context)]
+        return b"".join(output)
+
+    def decrypt(self, value, complete=True, context=b"", legacy=False):
+        """
+        Decifra um valor gravado por encrypt() com o mesmo 'context'; textos não cifrados são devolvidos
+        como estão. Com complete=False, 'value' é só um prefixo: decifra os blocos inteiros presentes nele.
+        Levanta ValueError se algum bloco tiver sido alterado, o contexto não conferir ou a chave estiver
+        errada. Valores no formato antigo só são aceitos com legacy=True.
+        """
+        if isinstance(value, bytes) and value.startswith(self.LEGACY_MAGIC):
+            if not legacy:
+                raise ValueError("Dado cifrado no formato antigo, sem contexto.")
+            context = None
+        elif not isinstance(value, bytes) or not value.startswith(self.MAGIC):
+            return value
+        nonce = value[len(self.MAGIC):self.HEADER_SIZE]
+        body = value[self.HEADER_SIZE:]
+        block_size = CIPHER_CHUNK_SIZE + self.TAG_SIZE
+        blocks = [body[start:start + block_size] for start in range(0, len(body), block_size)]
+        if not complete and blocks and len(blocks[-1]) < block_size:
+            blocks.pop() # bloco cortado pelo prefixo
+        data = []
+        for index, block in enumerate(blocks):
+            ciphertext, tag = block[:-self.TAG_SIZE], block[-self.TAG_SIZE:]
+            if not hmac.compare_digest(tag, self._tag(nonce, index, complete and index == len(blocks) - 1, ciphertext, context)):
+                raise ValueError("Dados cifrados inválidos ou senha incorreta.")
+            data.append(self._xor(ciphertext, self._keystream(nonce, index, len(ciphertext))))
+        return b"".join(data).decode("utf-8", errors="ignore" if not complete else "strict")
+
+class TaskCache:
+    """
+    Cache LRU dos objetos Task lidos recentemente, com no máximo 'capacity' itens. Reaproveitar o objeto
+    evita decifrar o título e buscar tags de novo ao voltar a uma página; qualquer gravação no banco
+    (desta ou de outra conexão) invalida o cache inteiro.
+    """
+    def __init__(self, capacity=TASK_CACHE_SIZE):
+        self.capacity = capacity
+        self.version = None
+        self._tasks = OrderedDict()
+
+    def get(self, task_id):
+        task = self._tasks.get(task_id)
+        if task is not None:
+            self._tasks.move_to_end(task_id)
+        return task
+
+    def put(self, task):
+        self._tasks[task.id] = task
+        self._tasks.move_to_end(task.id)
+        while len(self._tasks) > self.capacity:
+            self._tasks.popitem(last=False)
+
+    def validate(self, version):
+        """Descarta tudo se o banco mudou desde a última leitura."""
+        if version != self.version:
+            self._tasks.clear()
+            self.version = version
+
+    def __len__(self):
+        return len(self._tasks)
+
+def next_occurrence(current, frequency, every=1, anchor_day=None):
+    """
+    Retorna a data da ocorrência seguinte a 'current'. Nas repetições mensais, 'anchor_day' guarda
+    o dia original, para que uma série do dia 31 volte ao dia 31 depois de passar por um mês curto.
+    """
+    if frequency == "diaria":
+        return current + timedelta(days=every)
+    if frequency == "semanal":
+        return current + timedelta(weeks=every)
+    month_index = current.month - 1 + every
+    year, month = current.year + month_index // 12, month_index % 12 + 1
+    day = min(anchor_day or current.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+def parse_quick_add(line):
+    """
+    Interpreta uma linha da adição rápida, ex.: "Pagar conta !alta @financeiro ^2026-11-01 *mensal".
+    !prioridade, @tag (quantas quiser), ^data (AAAA-MM-DD, hoje ou amanha) e *repetição (diaria, semanal
+    ou mensal); o restante é o título. Levanta ValueError com uma mensagem se algum marcador for inválido.
+    """
+    priorities = {"alta": "Alta", "media": "Média", "média": "Média", "baixa": "Baixa"}
+    recurrences = {"diaria": "diaria", "diária": "diaria", "semanal": "semanal", "mensal": "mensal"}
+    task = {"title": "", "priority": "Média", "due_date": None, "tags": [], "recurrence": None}
+    words = []
+    for word in line.split():
+        marker, value = word[0], word[1:].lower()
+        if marker == "!" and value:
+            if value not in priorities:
+                raise ValueError(f"Prioridade desconhecida: '{word}'.")
+            task["priority"] = priorities[value]
+        elif marker == "@" and value:
+            task["tags"] += [tag for tag in parse_tags(word[1:]) if tag.lower() not in map(str.lower, task["tags"])]
+        elif marker == "^" and value:
+            relative = {"hoje": 0, "amanha": 1, "amanhã": 1}
+            if value in relative:
+                task["due_date"] = (date.today() + timedelta(days=relative[value])).isoformat()
+            else:
+                try: task["due_date"] = date.fromisoformat(value).isoformat()
+                except ValueError: raise ValueError(f"Data inválida: '{word}' (use AAAA-MM-DD).")
+        elif marker == "*" and value:
+            if value not in recurrences:
+                raise ValueError(f"Repetição desconhecida: '{word}'.")
+            task["recurrence"] = (recurrences[value], 1)
+        else:
+            words.append(word)
+    task["title"] = " ".join(words)
+    if not task["title"]:
+        raise ValueError("A tarefa precisa de um título.")
+    return task
+
+def parse_tags(text):
+    """Converte um texto como 'trabalho, #urgente' na lista de tags ['trabalho', 'urgente']."""
+    tags = []
+    for name in text.replace(",", " ").split():
+        name = name.lstrip("#")
+        if name and name.lower() not in (tag.lower() for tag in tags):
+            tags.append(name)
+    return tags
 
 class TaskManager:
     """
     Gerencia a lógica de negócios e a persistência das tarefas usando SQLite.
+    Com uma senha ('passphrase'), título e descrição são gravados cifrados (ver FieldCipher).
+    Tarefas concluídas há mais de ARCHIVE_AFTER_DAYS dias e tarefas excluídas são
+    movidas para a tabela 'archived_tasks', mantendo a tabela 'tasks' pequena.
+    As subtarefas apontam para a tarefa pai por 'parent_id'.
+    As tags ficam normalizadas em 'tags' e na tabela de junção 'task_tags', indexada nos dois sentidos.
+    A coluna 'score' guarda a pontuação de cada tarefa para a visão "Próximas" (ver RANKING_WEIGHTS).
+    Uma tarefa repetitiva é uma única linha (a próxima ocorrência pendente) com sua regra em 'recurrences'.
+    As estatísticas vêm de tabelas de resumo ('daily_stats', 'open_by_due', 'overdue_history')
+    atualizadas a cada alteração, e não de uma varredura da tabela de tarefas.
     """
-    def __init__(self, db_filename=DB_FILENAME):
+    SCHEMA_VERSION = 6
+    CHECK_CONTEXT = b"encryption_check" # Contexto do valor de verificação da senha (settings)
+
+    def __init__(self, db_filename=DB_FILENAME, archive_db_filename=ARCHIVE_DB_FILENAME, passphrase=None,
+                 cache_size=TASK_CACHE_SIZE):
         self.db_filename = db_filename
-        self.conn = sqlite3.connect(self.db_filename)
+        self.archive_db_filename = archive_db_filename
+        # Com um banco de arquivo separado, o histórico fica no schema anexado 'archive'.
+        self.archive_table = "archive.archived_tasks" if archive_db_filename else "archived_tasks"
+        self.cache_size = cache_size
+        # Conexão e cache LRU são por thread (ver 'conn'); todas as conexões abertas ficam registradas para o fechamento.
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.lock_stats = {"transactions": 0, "contended": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+        self.cipher = None
         self.create_table()
+        self._setup_encryption(passphrase)
+
+    @property
+    def conn(self):
+        """Conexão da thread atual, aberta no primeiro uso: threads nunca compartilham uma conexão."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    @property
+    def task_cache(self):
+        cache = getattr(self._local, "task_cache", None)
+        if cache is None:
+            cache = self._local.task_cache = TaskCache(self.cache_size)
+        return cache
+
+    def _connect(self):
+        """Abre uma nova conexão configurada (cada thread precisa da sua)."""
+        # check_same_thread=False só para que close_connection possa fechar as conexões das outras threads.
+        conn = sqlite3.connect(self.db_filename, timeout=BUSY_TIMEOUT_SECONDS, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        if not self.archive_db_filename:
+            # WAL: leitores não bloqueiam o escritor (nem o contrário). Com um banco de arquivo anexado fica o
+            # journal padrão, porque no WAL uma transação deixa de ser atômica entre os dois arquivos.
+            conn.execute("PRAGMA journal_mode = WAL")
+        # Limita o cache de páginas do SQLite (valor negativo = KiB) em vez de deixá-lo crescer com o banco.
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KIB}")
+        if self.archive_db_filename:
+            conn.execute("ATTACH DATABASE ? AS archive", (self.archive_db_filename,))
+        return conn
+
+    @contextmanager
+    def _write_transaction(self, conn=None):
+        """
+        Transação de escrita iniciada com BEGIN IMMEDIATE: o lock de escrita é obtido antes das leituras
+        da transação, então um "ler e depois gravar" nunca trabalha sobre dados que outra conexão alterou.
+        O tempo de espera pelo lock é acumulado em 'lock_stats'.
+        """
+        conn = conn or self.conn
+        started = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        waited = time.perf_counter() - started
+        with self._stats_lock:
+            self.lock_stats["transactions"] += 1
+            self.lock_stats["wait_seconds"] += waited
+            self.lock_stats["max_wait_seconds"] = max(self.lock_stats["max_wait_seconds"], waited)
+            if waited > LOCK_WAIT_THRESHOLD_SECONDS:
+                self.lock_stats["contended"] += 1
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
 
     def create_table(self):
         """Cria a tabela de tarefas no banco de dados se ela não existir."""
         cursor = self.conn.cursor()
+        # O modo incremental permite devolver páginas livres aos poucos, sem um VACUUM completo.
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            cursor.execute("VACUUM")
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS tasks (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -45,60 +420,955 @@ class TaskManager:
             )
         """)
         self.conn.commit()
+        self._migrate_schema()
+
+    def _migrate_schema(self):
+        """Aplica, em ordem, as migrações ainda não aplicadas (controladas por PRAGMA user_version)."""
+        with self._write_transaction() as cursor: # Dois processos abrindo o mesmo banco não migram ao mesmo tempo
+            self._apply_migrations(cursor, cursor.execute("PRAGMA user_version").fetchone()[0])
+        self._check_ranking_weights()
+
+    def _apply_migrations(self, cursor, version):
+        self._create_archive_table(cursor)
+        if version < 1:
+            cursor.execute("ALTER TABLE tasks ADD COLUMN completed_at TEXT")
+            # Tarefas já concluídas passam a contar a partir de agora para o arquivamento.
+            cursor.execute("UPDATE tasks SET completed_at = ? WHERE is_completed = 1", (self._now(),))
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks (is_completed, completed_at)")
+        if version < 2:
+            cursor.execute("ALTER TABLE tasks ADD COLUMN parent_id INTEGER REFERENCES tasks (id)")
+            cursor.execute("ALTER TABLE tasks ADD COLUMN subtree_total INTEGER NOT NULL DEFAULT 0")
+            cursor.execute("ALTER TABLE tasks ADD COLUMN subtree_done INTEGER NOT NULL DEFAULT 0")
+            # Atende tanto a busca dos filhos de um nó quanto a das raízes (parent_id IS NULL), já na ordem de exibição.
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_parent ON tasks (parent_id, is_completed, id)")
+        if version < 3:
+            cursor.execute("CREATE TABLE IF NOT EXISTS tags (id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE COLLATE NOCASE)")
+            # A chave primária atende "tags de uma tarefa"; o índice secundário atende "tarefas de uma tag".
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS task_tags (
+                    task_id INTEGER NOT NULL,
+                    tag_id INTEGER NOT NULL,
+                    PRIMARY KEY (task_id, tag_id)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_tags_tag ON task_tags (tag_id, task_id)")
+            # Cada categoria existente (inclusive no arquivo) vira uma tag da tarefa.
+            legacy = f"SELECT id, trim(category) AS name FROM tasks UNION ALL SELECT id, trim(category) FROM {self.archive_table}"
+            cursor.execute(f"INSERT OR IGNORE INTO tags (name) SELECT name FROM ({legacy}) WHERE name IS NOT NULL AND name != ''")
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO task_tags (task_id, tag_id)
+                SELECT legacy.id, tags.id FROM ({legacy}) AS legacy JOIN tags ON tags.name = legacy.name
+            """)
+        if version < 4:
+            cursor.execute("CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)")
+            cursor.execute("ALTER TABLE tags ADD COLUMN weight REAL NOT NULL DEFAULT 0")
+            cursor.execute("ALTER TABLE tasks ADD COLUMN created_at TEXT")
+            cursor.execute("ALTER TABLE tasks ADD COLUMN score REAL")
+            cursor.execute("UPDATE tasks SET created_at = ?", (self._now(),))
+            # Índice parcial só com as tarefas pendentes: o "Próximas" lê os K primeiros direto dele, sem ordenar.
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_next_up ON tasks (score DESC) WHERE is_completed = 0")
+        if version < 5:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS recurrences (
+                    task_id INTEGER PRIMARY KEY,
+                    frequency TEXT NOT NULL,
+                    every INTEGER NOT NULL DEFAULT 1,
+                    anchor_day INTEGER
+                )
+            """)
+        if version < 6:
+            # Criadas/concluídas por dia e prioridade, e tarefas pendentes por prazo e prioridade ('' = sem prazo).
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS daily_stats (
+                    day TEXT NOT NULL,
+                    priority TEXT NOT NULL,
+                    created INTEGER NOT NULL DEFAULT 0,
+                    completed INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, priority)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS open_by_due (
+                    due_date TEXT NOT NULL,
+                    priority TEXT NOT NULL,
+                    open_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (due_date, priority)
+                ) WITHOUT ROWID
+            """)
+            cursor.execute("CREATE TABLE IF NOT EXISTS overdue_history (day TEXT PRIMARY KEY, overdue INTEGER NOT NULL)")
+            # Carga inicial a partir do que já existe (inclusive o histórico arquivado).
+            self._sync_archive_columns(cursor)
+            history = f"""
+                SELECT priority, created_at, is_completed, completed_at FROM tasks
+                UNION ALL SELECT priority, created_at, is_completed, completed_at FROM {self.archive_table}
+            """
+            cursor.execute(f"""
+                INSERT INTO daily_stats (day, priority, created, completed)
+                SELECT day, priority, SUM(created), SUM(completed) FROM (
+                    SELECT substr(created_at, 1, 10) AS day, COALESCE(priority, '') AS priority, 1 AS created, 0 AS completed
+                    FROM ({history}) WHERE created_at IS NOT NULL
+                    UNION ALL
+                    SELECT substr(completed_at, 1, 10), COALESCE(priority, ''), 0, 1
+                    FROM ({history}) WHERE is_completed = 1 AND completed_at IS NOT NULL
+                ) GROUP BY day, priority
+            """)
+            self._record_open(cursor, "1", (), 1)
+        self._sync_archive_columns(cursor)
+        cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _create_archive_table(self, cursor):
+        """Cria a tabela de histórico (no banco principal ou no banco de arquivo anexado)."""
+        index_name = "archive.idx_archived_at" if self.archive_db_filename else "idx_archived_at"
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.archive_table} (
+                id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT,
+                priority TEXT,
+                due_date TEXT,
+                category TEXT,
+                is_completed INTEGER NOT NULL DEFAULT 0,
+                completed_at TEXT,
+                archived_at TEXT NOT NULL,
+                archive_reason TEXT NOT NULL
+            )
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON archived_tasks (archived_at)")
+
+    def _sync_archive_columns(self, cursor):
+        # Colunas novas da tabela 'tasks' são replicadas no arquivo (que pode ser um banco criado em outra versão).
+        schema = "archive." if self.archive_db_filename else ""
+        archived_columns = {row["name"] for row in cursor.execute(f"PRAGMA {schema}table_info(archived_tasks)")}
+        for row in cursor.execute("PRAGMA table_info(tasks)").fetchall():
+            if row["name"] not in archived_columns:
+                default = f" DEFAULT {row['dflt_value']}" if row["dflt_value"] is not None else ""
+                cursor.execute(f"ALTER TABLE {self.archive_table} ADD COLUMN {row['name']} {row['type']}{default}")
+
+    def _setup_encryption(self, passphrase):
+        """
+        Deriva a chave da sessão. Na primeira vez que uma senha é usada, gera o sal, grava um valor de
+        verificação e cifra as tarefas já existentes (ativas e arquivadas) em uma única transação.
+        """
+        cursor = self.conn.cursor()
+        settings = {row["key"]: row["value"] for row in cursor.execute(
+            "SELECT key, value FROM settings WHERE key IN ('encryption_salt', 'encryption_check')")}
+        if not passphrase:
+            if "encryption_salt" in settings:
+                raise ValueError(f"Este banco está criptografado: defina a senha na variável {PASSPHRASE_ENV_VAR}.")
+            return
+        if "encryption_salt" in settings:
+            self.cipher = FieldCipher(passphrase, bytes.fromhex(settings["encryption_salt"]))
+            # ValueError se a senha estiver errada
+            if self.cipher.decrypt(bytes.fromhex(settings["encryption_check"]), context=self.CHECK_CONTEXT, legacy=True) != "ok":
+                raise ValueError("Senha de criptografia incorreta.")
+            with self._write_transaction() as cursor:
+                self._upgrade_legacy_encryption(cursor)
+            return
+        salt = os.urandom(16)
+        self.cipher = FieldCipher(passphrase, salt)
+        with self._write_transaction() as cursor:
+            cursor.execute("INSERT INTO settings (key, value) VALUES ('encryption_salt', ?)", (salt.hex(),))
+            cursor.execute("INSERT INTO settings (key, value) VALUES ('encryption_check', ?)",
+                           (self.cipher.encrypt("ok", self.CHECK_CONTEXT).hex(),))
+            self._reseal_all(cursor, self._seal)
+
+    def _upgrade_legacy_encryption(self, cursor):
+        """Converte, uma única vez, um banco cifrado no formato sem contexto (FieldCipher.LEGACY_MAGIC)."""
+        row = cursor.execute("SELECT value FROM settings WHERE key = 'encryption_check'").fetchone()
+        if not bytes.fromhex(row["value"]).startswith(FieldCipher.LEGACY_MAGIC):
+            return
+        cursor.execute("UPDATE settings SET value = ? WHERE key = 'encryption_check'",
+                       (self.cipher.encrypt("ok", self.CHECK_CONTEXT).hex(),))
+        self._reseal_all(cursor, lambda value, column, task_id: self._seal(
+            self.cipher.decrypt(value, legacy=True), column, task_id))
+
+    def _reseal_all(self, cursor, convert):
+        """Regrava título e descrição de todas as tarefas (ativas e arquivadas) com convert(valor, coluna, id)."""
+        for table in ("tasks", self.archive_table):
+            # Em lotes por faixa de ID, para não carregar a tabela inteira de uma vez.
+            last_id = 0
+            while rows := cursor.execute(f"SELECT id, title, description FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+                                         (last_id, FETCH_BATCH_SIZE)).fetchall():
+                cursor.executemany(f"UPDATE {table} SET title = ?, description = ? WHERE id = ?",
+                                   [(convert(row["title"], "title", row["id"]), convert(row["description"], "description", row["id"]),
+                                     row["id"]) for row in rows])
+                last_id = rows[-1]["id"]
+
+    def _seal(self, text, column, task_id):
+        """Prepara um campo para gravação: cifrado (e ligado à coluna e à tarefa) se a criptografia estiver ativa."""
+        return self.cipher.encrypt(text, FieldCipher.context(column, task_id)) if self.cipher else text
+
+    def _open(self, value, column, task_id):
+        return self.cipher.decrypt(value, context=FieldCipher.context(column, task_id)) if self.cipher else value
+
+    @staticmethod
+    def _next_task_id(cursor):
+        """
+        ID que o próximo INSERT em 'tasks' receberia (AUTOINCREMENT), para cifrar os campos já ligados a ele.
+        Só é confiável dentro de uma transação de escrita, que impede outro INSERT no meio.
+        """
+        return cursor.execute("""
+            SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'tasks'), 0),
+                       COALESCE((SELECT MAX(id) FROM tasks), 0)) + 1
+        """).fetchone()[0]
+
+    @staticmethod
+    def _now():
+        return datetime.now().isoformat(timespec="seconds")
 
     def get_all_tasks(self):
-        """Carrega todas as tarefas do banco de dados."""
+        """Carrega todas as tarefas ativas do banco de dados (prefira iter_tasks em bancos grandes)."""
+        return list(self.iter_tasks())
+
+    def iter_tasks(self):
+        """Percorre todas as tarefas ativas lendo FETCH_BATCH_SIZE linhas por vez."""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM tasks")
-        rows = cursor.fetchall()
+        cursor.execute(f"SELECT {self._list_columns()} FROM tasks ORDER BY id")
+        for rows in self._iter_batches(cursor):
+            yield from self._tasks_from_rows(rows)
+
+    @staticmethod
+    def _iter_batches(cursor):
+        while rows := cursor.fetchmany(FETCH_BATCH_SIZE):
+            yield rows
+
+    def _load_tasks(self, cursor):
+        """Materializa o resultado de uma consulta de listagem, lote a lote."""
         tasks = []
+        for rows in self._iter_batches(cursor):
+            tasks += self._tasks_from_rows(rows)
+        return tasks
+
+    def _tasks_from_rows(self, rows):
+        """
+        Converte linhas em objetos Task, reaproveitando os que estão no cache LRU;
+        só as tarefas novas passam por _attach_details.
+        """
+        self.task_cache.validate((self.conn.total_changes, self.conn.execute("PRAGMA data_version").fetchone()[0]))
+        tasks, loaded = [], []
         for row in rows:
-            tasks.append(Task(id=row[0], title=row[1], description=row[2], priority=row[3], 
-                              due_date=row[4], category=row[5], is_completed=bool(row[6])))
+            task = self.task_cache.get(row["id"])
+            if task is None:
+                task = Task.from_row(row, self.cipher)
+                loaded.append(task)
+                self.task_cache.put(task)
+            tasks.append(task)
+        self._attach_details(loaded)
         return tasks
 
-    def add_task(self, title, description, priority, due_date, category):
-        """Adiciona uma nova tarefa ao banco de dados."""
-        if not title:
-            return None
+    def _has_more_children(self, parent_id, key):
+        """Indica se há filhos de 'parent_id' (None = tarefas raiz) depois da chave (is_completed, id)."""
+        return self.conn.execute("""
+            SELECT EXISTS (SELECT 1 FROM tasks WHERE parent_id IS ? AND (is_completed, id) > (?, ?))
+        """, (parent_id, *key)).fetchone()[0] == 1
+
+    def get_visible_tree(self, expanded_ids, after=None, limit=PAGE_SIZE, child_after=None):
+        """
+        Retorna ([(tarefa, profundidade)], próxima_chave, próximas_chaves_dos_filhos) na ordem de exibição:
+        uma página de 'limit' tarefas raiz a partir da chave (is_completed, id) 'after' e, recursivamente,
+        uma página de até 'limit' filhos de cada nó em 'expanded_ids', a partir de child_after[id]. Subárvores
+        recolhidas nem chegam a ser lidas. 'próxima_chave' é None na última página de raízes e
+        'próximas_chaves_dos_filhos' ({id_do_pai: chave}) só traz os nós que têm mais filhos depois da página.
+        """
+        child_after = child_after or {}
+        expanded = [[task_id, *child_after.get(task_id, (-1, 0))] for task_id in sorted(expanded_ids)]
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            WITH RECURSIVE roots (id, is_completed) AS (
+                -- Paginação por chave (keyset) sobre idx_tasks_parent: o custo não depende da posição da página.
+                SELECT id, is_completed FROM tasks WHERE parent_id IS NULL AND (is_completed, id) > (?, ?)
+                ORDER BY is_completed, id LIMIT ?
+            ),
+            expanded (id, after_completed, after_id) AS (
+                SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]'), json_extract(value, '$[2]') FROM json_each(?)
+            ),
+            visible (id, depth, path) AS (
+                SELECT id, 0, printf('%d-%012d', is_completed, id) FROM roots
+                UNION ALL
+                -- Os filhos de cada nó expandido também são lidos uma página por vez, pelo mesmo índice.
+                SELECT t.id, v.depth + 1, v.path || '/' || printf('%d-%012d', t.is_completed, t.id)
+                FROM visible v JOIN expanded e ON e.id = v.id
+                JOIN tasks t ON t.id IN (
+                    SELECT c.id FROM tasks c WHERE c.parent_id = v.id AND (c.is_completed, c.id) > (e.after_completed, e.after_id)
+                    ORDER BY c.is_completed, c.id LIMIT ?
+                )
+            )
+            SELECT {self._list_columns("t")}, v.depth FROM visible v JOIN tasks t ON t.id = v.id
+            ORDER BY v.path
+        """, (*(after or (-1, 0)), limit, json.dumps(expanded), limit))
+        rows = []
+        for batch in self._iter_batches(cursor):
+            rows += zip(self._tasks_from_rows(batch), [row["depth"] for row in batch])
+        last_child, shown = {}, {}
+        for task, _ in rows:
+            last_child[task.parent_id] = task # Linhas em ordem de exibição: o último visto é o último da página
+            shown[task.parent_id] = shown.get(task.parent_id, 0) + 1
+        next_keys = {}
+        for parent_id, task in last_child.items():
+            key = (int(task.is_completed), task.id)
+            if shown[parent_id] == limit and self._has_more_children(parent_id, key):
+                next_keys[parent_id] = key
+        return rows, next_keys.pop(None, None), next_keys
+
+    def _attach_details(self, tasks):
+        """
+        Preenche 'task.tags', 'task.recurrence' e 'task.anchor_day' de uma lista de tarefas com uma consulta para cada
+        (chaves primárias de task_tags e recurrences), em vez de uma por tarefa.
+        """
+        by_id = {task.id: task for task in tasks}
+        if not by_id:
+            return tasks
+        ids = json.dumps(list(by_id))
         cursor = self.conn.cursor()
         cursor.execute("""
-            INSERT INTO tasks (title, description, priority, due_date, category, is_completed)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (title, description, priority, due_date, category, 0))
-        self.conn.commit()
-        return cursor.lastrowid # Retorna o ID da nova tarefa
+            SELECT tt.task_id, tags.name FROM task_tags tt JOIN tags ON tags.id = tt.tag_id
+            WHERE tt.task_id IN (SELECT value FROM json_each(?)) ORDER BY tags.name
+        """, (ids,))
+        for row in cursor.fetchall():
+            by_id[row["task_id"]].tags.append(row["name"])
+        cursor.execute("SELECT task_id, frequency, every, anchor_day FROM recurrences WHERE task_id IN (SELECT value FROM json_each(?))", (ids,))
+        for row in cursor.fetchall():
+            by_id[row["task_id"]].recurrence = (row["frequency"], row["every"])
+            by_id[row["task_id"]].anchor_day = row["anchor_day"]
+        return tasks
 
-    def update_task(self, task):
-        """Atualiza os dados de uma tarefa existente no banco de dados."""
+    def _set_recurrence(self, cursor, task, reset_anchor=True):
+        """
+        Grava (ou remove) a regra de repetição da tarefa. Uma série precisa de um prazo: sem ele, começa hoje.
+        O dia-âncora das séries mensais só é redefinido quando o prazo foi alterado pelo usuário.
+        """
+        if not task.recurrence:
+            cursor.execute("DELETE FROM recurrences WHERE task_id = ?", (task.id,))
+            task.anchor_day = None
+            return
+        if not task.due_date:
+            task.due_date = date.today().isoformat()
+            cursor.execute("UPDATE tasks SET due_date = ? WHERE id = ?", (task.due_date, task.id))
+        frequency, every = task.recurrence
+        cursor.execute("""
+            INSERT INTO recurrences (task_id, frequency, every, anchor_day) VALUES (?, ?, ?, ?)
+            ON CONFLICT (task_id) DO UPDATE SET frequency = excluded.frequency, every = excluded.every,
+                anchor_day = CASE WHEN ? THEN excluded.anchor_day ELSE anchor_day END
+        """, (task.id, frequency, every, date.fromisoformat(task.due_date).day, reset_anchor))
+        if reset_anchor:
+            task.anchor_day = date.fromisoformat(task.due_date).day
+        elif task.anchor_day is None:
+            task.anchor_day = cursor.execute("SELECT anchor_day FROM recurrences WHERE task_id = ?", (task.id,)).fetchone()[0]
+
+    def get_occurrences(self, task, start=None, end=None):
+        """
+        Gera (sem gravar nada) as datas das ocorrências de uma tarefa repetitiva entre 'start' e 'end'
+        (por padrão, os próximos RECURRENCE_WINDOW_DAYS dias). Só a ocorrência pendente existe no banco.
+        """
+        if not task.recurrence or not task.due_date:
+            return
+        start = start or date.today()
+        end = end or start + timedelta(days=RECURRENCE_WINDOW_DAYS)
+        frequency, every = task.recurrence
+        occurrence = date.fromisoformat(task.due_date)
+        while occurrence <= end:
+            if occurrence >= start:
+                yield occurrence
+            occurrence = next_occurrence(occurrence, frequency, every, task.anchor_day)
+
+    def _complete_occurrence(self, cursor, task):
+        """
+        Conclui a ocorrência atual de uma tarefa repetitiva: grava uma cópia concluída (histórico)
+        e avança a própria tarefa para a próxima ocorrência, que continua pendente.
+        """
+        history_id = self._next_task_id(cursor)
+        cursor.execute("""
+            INSERT INTO tasks (id, title, description, priority, due_date, is_completed, completed_at, parent_id, created_at)
+            VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?)
+        """, (history_id, self._seal(task.title, "title", history_id), self._seal(task.description, "description", history_id),
+              task.priority, task.due_date, task.completed_at, task.parent_id, self._now()))
+        self._record_daily(cursor, task.completed_at[:10], task.priority, completed=1)
+        self._set_tags(cursor, history_id, task.tags)
+        self._refresh_scores(cursor, "id = ?", (history_id,))
+        self._adjust_ancestors(cursor, task.parent_id, 1, 1)
+
+        anchor = cursor.execute("SELECT anchor_day FROM recurrences WHERE task_id = ?", (task.id,)).fetchone()
+        frequency, every = task.recurrence
+        occurrence = date.fromisoformat(task.due_date)
+        # Ocorrências que venceram sem ser concluídas não são geradas retroativamente.
+        while occurrence < date.today() or occurrence <= date.fromisoformat(task.due_date):
+            occurrence = next_occurrence(occurrence, frequency, every, anchor and anchor["anchor_day"])
+        task.due_date = occurrence.isoformat()
+        task.is_completed, task.completed_at = False, None
+
+    def _set_tags(self, cursor, task_id, tags):
+        """Substitui as tags de uma tarefa, criando as que ainda não existem."""
+        cursor.execute("DELETE FROM task_tags WHERE task_id = ?", (task_id,))
+        for name in tags:
+            cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (name,))
+            cursor.execute("""
+                INSERT OR IGNORE INTO task_tags (task_id, tag_id) SELECT ?, id FROM tags WHERE name = ?
+            """, (task_id, name))
+
+    def get_tasks_by_tags(self, include=(), exclude=(), after=None, limit=PAGE_SIZE):
+        """
+        Retorna (tarefas, próxima_chave): uma página das tarefas que têm todas as tags de 'include' e nenhuma
+        de 'exclude' (ex.: "A E B, NÃO C"), resolvendo o filtro com INTERSECT/EXCEPT sobre o índice de task_tags.
+        A paginação segue a mesma chave (is_completed, id) da árvore.
+        """
+        tagged = "SELECT task_id FROM task_tags WHERE tag_id = (SELECT id FROM tags WHERE name = ?)"
+        selects = [tagged] * len(include) or ["SELECT id FROM tasks"]
+        query = " INTERSECT ".join(selects)
+        params = list(include)
+        if exclude:
+            query += f" EXCEPT SELECT task_id FROM task_tags WHERE tag_id IN (SELECT id FROM tags WHERE name IN ({', '.join('?' * len(exclude))}))"
+            params += list(exclude)
         cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT {self._list_columns()} FROM tasks WHERE id IN ({query}) AND (is_completed, id) > (?, ?)
+            ORDER BY is_completed, id LIMIT ?
+        """, params + [*(after or (-1, 0)), limit + 1]) # Uma a mais só para saber se há próxima página
+        tasks = self._load_tasks(cursor)
+        next_key = (int(tasks[limit - 1].is_completed), tasks[limit - 1].id) if len(tasks) > limit else None
+        return tasks[:limit], next_key
+
+    def _list_columns(self, alias=""):
+        """
+        Colunas das consultas de listagem: a descrição vem truncada com substr(), mais um indicador
+        de que há mais texto. Cifrada, a prévia é o primeiro bloco inteiro, que pode ser verificado sozinho.
+        """
+        prefix = f"{alias}." if alias else ""
+        preview_size = DESCRIPTION_PREVIEW_LENGTH
+        if self.cipher:
+            preview_size = FieldCipher.HEADER_SIZE + CIPHER_CHUNK_SIZE + FieldCipher.TAG_SIZE
+        columns = []
+        for column in TASK_COLUMNS.split(","):
+            column = column.strip()
+            if column == "description":
+                columns.append(f"substr({prefix}description, 1, {preview_size}) AS description")
+                columns.append(f"length({prefix}description) > {preview_size} AS description_truncated")
+            else:
+                columns.append(prefix + column)
+        return ", ".join(columns)
+
+    def load_description(self, task):
+        """Lê a descrição completa de uma tarefa listada com prévia (só quando ela é expandida ou editada)."""
+        if task.description_truncated:
+            row = self.conn.execute("SELECT description FROM tasks WHERE id = ?", (task.id,)).fetchone()
+            task.description = self._open(row["description"], "description", task.id) if row else ""
+        return task.description
+
+    @staticmethod
+    def _subtree_condition(root_condition, table="tasks"):
+        """Condição WHERE que seleciona as tarefas que atendem 'root_condition' e todos os seus descendentes."""
+        return f"""id IN (
+            WITH RECURSIVE subtree (id) AS (
+                SELECT id FROM {table} WHERE {root_condition}
+                UNION ALL SELECT t.id FROM subtree s JOIN {table} t ON t.parent_id = s.id
+            ) SELECT id FROM subtree)"""
+
+    def _adjust_ancestors(self, cursor, parent_id, delta_total, delta_done):
+        """Atualiza incrementalmente os contadores de 'parent_id' e de todos os seus ancestrais."""
+        if parent_id is None or (delta_total == 0 and delta_done == 0):
+            return
         cursor.execute("""
-            UPDATE tasks
-            SET title = ?, description = ?, priority = ?, due_date = ?, category = ?, is_completed = ?
-            WHERE id = ?
-        """, (task.title, task.description, task.priority, task.due_date, task.category, 
-              1 if task.is_completed else 0, task.id))
-        self.conn.commit()
+            WITH RECURSIVE ancestors (id) AS (
+                SELECT ? UNION ALL SELECT t.parent_id FROM ancestors a JOIN tasks t ON t.id = a.id
+                WHERE t.parent_id IS NOT NULL
+            )
+            UPDATE tasks SET subtree_total = subtree_total + ?, subtree_done = subtree_done + ?
+            WHERE id IN (SELECT id FROM ancestors)
+        """, (parent_id, delta_total, delta_done))
+
+    def _recompute_subtree_counts(self, cursor, root_id):
+        """Recalcula do zero os contadores de uma subárvore (usado apenas ao restaurar do arquivo)."""
+        cursor.execute("""
+            WITH RECURSIVE subtree (id) AS (
+                SELECT ? UNION ALL SELECT t.id FROM subtree s JOIN tasks t ON t.parent_id = s.id
+            ),
+            pairs (ancestor, id) AS (
+                SELECT id, id FROM subtree
+                UNION ALL SELECT p.ancestor, t.id FROM pairs p JOIN tasks t ON t.parent_id = p.id
+            ),
+            counts (id, total, done) AS (
+                SELECT p.ancestor, COUNT(*), SUM(t.is_completed) FROM pairs p JOIN tasks t ON t.id = p.id
+                WHERE p.id != p.ancestor GROUP BY p.ancestor
+            )
+            UPDATE tasks SET
+                subtree_total = COALESCE((SELECT total FROM counts WHERE counts.id = tasks.id), 0),
+                subtree_done = COALESCE((SELECT done FROM counts WHERE counts.id = tasks.id), 0)
+            WHERE id IN (SELECT id FROM subtree)
+        """, (root_id,))
+
+    def _record_daily(self, cursor, day, priority, created=0, completed=0):
+        """Soma 'created'/'completed' ao resumo diário de 'day' (AAAA-MM-DD) para a prioridade dada."""
+        cursor.execute("""
+            INSERT INTO daily_stats (day, priority, created, completed) VALUES (?, ?, ?, ?)
+            ON CONFLICT (day, priority) DO UPDATE SET
+                created = created + excluded.created, completed = completed + excluded.completed
+        """, (day, priority or "", created, completed))
+
+    def _record_open(self, cursor, where, params, sign):
+        """Soma (sign=1) ou subtrai (sign=-1) as tarefas pendentes que atendem 'where' do resumo por prazo."""
+        cursor.execute(f"""
+            INSERT INTO open_by_due (due_date, priority, open_count)
+            SELECT COALESCE(due_date, ''), COALESCE(priority, ''), ? * COUNT(*) FROM tasks
+            WHERE is_completed = 0 AND ({where}) GROUP BY 1, 2
+            ON CONFLICT (due_date, priority) DO UPDATE SET open_count = open_count + excluded.open_count
+        """, (sign, *params))
+
+    def _snapshot_overdue(self, cursor):
+        """Grava o total de tarefas atrasadas de hoje, para a série histórica de atrasos."""
+        cursor.execute("""
+            INSERT OR REPLACE INTO overdue_history (day, overdue)
+            SELECT ?, COALESCE(SUM(open_count), 0) FROM open_by_due WHERE due_date != '' AND due_date < ?
+        """, (date.today().isoformat(), date.today().isoformat()))
+
+    def get_statistics(self, days=STATS_WINDOW_DAYS):
+        """
+        Monta os dados do painel de estatísticas lendo apenas as tabelas de resumo:
+        por dia, por semana, por prioridade, atrasadas agora e a evolução dos atrasos.
+        """
+        today = date.today()
+        start = (today - timedelta(days=days - 1)).isoformat()
+        with self._write_transaction() as cursor:
+            self._snapshot_overdue(cursor)
+        cursor = self.conn.cursor()
+        daily = cursor.execute("""
+            SELECT day, SUM(created) AS created, SUM(completed) AS completed FROM daily_stats
+            WHERE day >= ? GROUP BY day ORDER BY day
+        """, (start,)).fetchall()
+        weekly = cursor.execute("""
+            SELECT strftime('%Y-%W', day) AS week, SUM(created) AS created, SUM(completed) AS completed
+            FROM daily_stats WHERE day >= ? GROUP BY week ORDER BY week
+        """, ((today - timedelta(weeks=12)).isoformat(),)).fetchall()
+        by_priority = {}
+        for row in cursor.execute("""
+            SELECT priority, SUM(created) AS created, SUM(completed) AS completed FROM daily_stats
+            WHERE day >= ? GROUP BY priority
+        """, (start,)):
+            by_priority[row["priority"]] = {"created": row["created"], "completed": row["completed"], "open": 0, "overdue": 0}
+        for row in cursor.execute("""
+            SELECT priority, SUM(open_count) AS open,
+                   SUM(CASE WHEN due_date != '' AND due_date < ? THEN open_count ELSE 0 END) AS overdue
+            FROM open_by_due GROUP BY priority
+        """, (today.isoformat(),)):
+            stats = by_priority.setdefault(row["priority"], {"created": 0, "completed": 0})
+            stats.update(open=row["open"], overdue=row["overdue"])
+        overdue_trend = cursor.execute(
+            "SELECT day, overdue FROM overdue_history WHERE day >= ? ORDER BY day", (start,)).fetchall()
+        return {
+            "daily": [(row["day"], row["created"], row["completed"]) for row in daily],
+            "weekly": [(row["week"], row["created"], row["completed"]) for row in weekly],
+            "by_priority": by_priority,
+            "overdue_now": sum(stats["overdue"] for stats in by_priority.values()),
+            "overdue_trend": [(row["day"], row["overdue"]) for row in overdue_trend],
+        }
+
+    def _score_expression(self):
+        """
+        Expressão SQL (e parâmetros) da pontuação de uma tarefa. Os termos de prazo e de idade usam as
+        datas absolutas: como "hoje" soma a mesma constante a todas as tarefas, a ordem não muda com o
+        passar dos dias e a pontuação só precisa ser recalculada quando a própria tarefa muda.
+        """
+        priority_weights = RANKING_WEIGHTS["priority"]
+        priority_case = " ".join("WHEN ? THEN ?" for _ in priority_weights)
+        expression = f"""
+            CASE priority {priority_case} ELSE 0 END
+            - ? * julianday(COALESCE(due_date, date(created_at, '+{NO_DUE_DATE_HORIZON_DAYS} days')))
+            - ? * julianday(created_at)
+            + COALESCE((SELECT SUM(tags.weight) FROM task_tags tt JOIN tags ON tags.id = tt.tag_id
+                        WHERE tt.task_id = tasks.id), 0)
+        """
+        params = [value for item in priority_weights.items() for value in item]
+        params += [RANKING_WEIGHTS["deadline_per_day"], RANKING_WEIGHTS["age_per_day"]]
+        return expression, params
+
+    def _refresh_scores(self, cursor, where, params=()):
+        """Recalcula a coluna 'score' apenas das tarefas que atendem 'where'."""
+        expression, score_params = self._score_expression()
+        cursor.execute(f"UPDATE tasks SET score = {expression} WHERE {where}", (*score_params, *params))
+
+    def _check_ranking_weights(self):
+        """Recalcula todas as pontuações só quando RANKING_WEIGHTS mudou desde a última execução."""
+        weights = json.dumps([RANKING_WEIGHTS, NO_DUE_DATE_HORIZON_DAYS], sort_keys=True)
+        with self._write_transaction() as cursor:
+            row = cursor.execute("SELECT value FROM settings WHERE key = 'ranking_weights'").fetchone()
+            if row is None or row["value"] != weights:
+                self._refresh_scores(cursor, "1")
+                cursor.execute("INSERT OR REPLACE INTO settings (key, value) VALUES ('ranking_weights', ?)", (weights,))
+
+    def set_tag_weight(self, name, weight):
+        """Define o peso de uma tag no ranking e atualiza só as tarefas que a possuem."""
+        with self._write_transaction() as cursor:
+            cursor.execute("UPDATE tags SET weight = ? WHERE name = ?", (weight, name))
+            self._refresh_scores(cursor, """id IN (
+                SELECT task_id FROM task_tags WHERE tag_id = (SELECT id FROM tags WHERE name = ?))""", (name,))
+
+    def get_next_tasks(self, limit=NEXT_UP_LIMIT):
+        """Retorna as 'limit' tarefas pendentes de maior pontuação, lidas em ordem do índice parcial."""
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT {self._list_columns()} FROM tasks INDEXED BY idx_tasks_next_up
+            WHERE is_completed = 0 ORDER BY score DESC LIMIT ?
+        """, (limit,))
+        return self._load_tasks(cursor)
+
+    def add_task(self, title, description, priority, due_date, tags=(), parent_id=None, recurrence=None):
+        """
+        Adiciona uma nova tarefa (ou subtarefa, se 'parent_id' for informado) ao banco de dados.
+        'recurrence' é None ou (frequência, intervalo), como em Task.recurrence.
+        """
+        if not title:
+            return None
+        with self._write_transaction() as cursor:
+            task_id = self._insert_task(cursor, title, description, priority, due_date, tags, parent_id, recurrence)
+        return task_id # Retorna o ID da nova tarefa
+
+    def add_tasks(self, entries):
+        """
+        Adiciona várias tarefas em uma única transação (ex.: uma colagem de várias linhas na adição rápida).
+        'entries' é uma lista de dicionários com title, priority, due_date, tags e recurrence. Retorna os IDs.
+        """
+        with self._write_transaction() as cursor:
+            return [self._insert_task(cursor, entry["title"], entry.get("description", ""), entry["priority"],
+                                      entry["due_date"], entry["tags"], None, entry["recurrence"]) for entry in entries]
+
+    def _insert_task(self, cursor, title, description, priority, due_date, tags, parent_id, recurrence):
+        task_id = self._next_task_id(cursor)
+        cursor.execute("""
+            INSERT INTO tasks (id, title, description, priority, due_date, is_completed, parent_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (task_id, self._seal(title, "title", task_id), self._seal(description, "description", task_id),
+              priority, due_date, 0, parent_id, self._now()))
+        self._set_tags(cursor, task_id, tags)
+        if recurrence:
+            self._set_recurrence(cursor, Task(task_id, title, description, due_date=due_date, recurrence=recurrence))
+        self._refresh_scores(cursor, "id = ?", (task_id,))
+        self._record_daily(cursor, date.today().isoformat(), priority, created=1)
+        self._record_open(cursor, "id = ?", (task_id,), 1)
+        self._adjust_ancestors(cursor, parent_id, 1, 0)
+        return task_id
+
+    def get_tasks(self, task_ids):
+        """Carrega as tarefas com os IDs informados, em ordem de ID."""
+        cursor = self.conn.cursor()
+        cursor.execute(f"""
+            SELECT {self._list_columns()} FROM tasks WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id
+        """, (json.dumps(list(task_ids)),))
+        return self._load_tasks(cursor)
+
+    def update_task(self, task):
+        """
+        Atualiza os dados de uma tarefa existente no banco de dados. Retorna False, sem gravar nada, se a
+        tarefa não estiver mais em 'tasks' (arquivada ou excluída enquanto era exibida ou editada).
+        """
+        if not task.is_completed:
+            task.completed_at = None
+        elif not task.completed_at:
+            task.completed_at = self._now()
+        with self._write_transaction() as cursor:
+            row = cursor.execute("""
+                SELECT is_completed, parent_id, due_date, priority, completed_at FROM tasks WHERE id = ?
+            """, (task.id,)).fetchone()
+            if row is None:
+                return False
+            self._record_open(cursor, "id = ?", (task.id,), -1)
+            self._set_recurrence(cursor, task, reset_anchor=row["due_date"] != task.due_date)
+            if task.recurrence and task.is_completed and not row["is_completed"]:
+                self.load_description(task) # o histórico guarda uma cópia completa
+                self._complete_occurrence(cursor, task)
+            # Uma descrição que só tem a prévia carregada não foi editada: o texto gravado é mantido.
+            keep_description = task.description_truncated
+            cursor.execute("""
+                UPDATE tasks
+                SET title = ?, description = CASE WHEN ? THEN description ELSE ? END,
+                    priority = ?, due_date = ?, is_completed = ?, completed_at = ?
+                WHERE id = ?
+            """, (self._seal(task.title, "title", task.id), keep_description,
+                  None if keep_description else self._seal(task.description, "description", task.id),
+                  task.priority, task.due_date, 1 if task.is_completed else 0, task.completed_at, task.id))
+            self._set_tags(cursor, task.id, task.tags)
+            self._refresh_scores(cursor, "id = ?", (task.id,))
+            self._record_open(cursor, "id = ?", (task.id,), 1)
+            if bool(row["is_completed"]) != task.is_completed:
+                self._adjust_ancestors(cursor, row["parent_id"], 0, 1 if task.is_completed else -1)
+                if task.is_completed:
+                    self._record_daily(cursor, task.completed_at[:10], task.priority, completed=1)
+                elif row["completed_at"]:
+                    self._record_daily(cursor, row["completed_at"][:10], row["priority"], completed=-1)
+        return True
 
     def delete_task(self, task_id):
-        """Remove uma tarefa do banco de dados pelo seu ID."""
+        """Exclui uma tarefa e suas subtarefas de forma reversível, movendo-as para o arquivo."""
+        with self._write_transaction() as cursor:
+            row = cursor.execute("""
+                SELECT parent_id, is_completed, subtree_total, subtree_done FROM tasks WHERE id = ?
+            """, (task_id,)).fetchone()
+            if row is None:
+                return
+            self._record_open(cursor, self._subtree_condition("id = ?"), (task_id,), -1)
+            self._move_to_archive(cursor, self._subtree_condition("id = ?"), (task_id,), "excluida")
+            self._adjust_ancestors(cursor, row["parent_id"], -(1 + row["subtree_total"]),
+                                   -(row["is_completed"] + row["subtree_done"]))
+
+    def _move_to_archive(self, cursor, where, params, reason):
+        """Copia as tarefas que atendem a 'where' para o arquivo e as remove da tabela ativa."""
+        cursor.execute(f"""
+            INSERT OR REPLACE INTO {self.archive_table} ({TASK_COLUMNS}, archived_at, archive_reason)
+            SELECT {TASK_COLUMNS}, ?, ? FROM tasks WHERE {where}
+        """, (self._now(), reason, *params))
+        cursor.execute(f"DELETE FROM tasks WHERE {where}", params)
+        return cursor.rowcount
+
+    def archive_completed_tasks(self, older_than_days=ARCHIVE_AFTER_DAYS, conn=None):
+        """Arquiva as tarefas concluídas há mais de 'older_than_days' dias. Retorna quantas foram movidas."""
+        conn = conn or self.conn
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat(timespec="seconds")
+        with self._write_transaction(conn) as cursor:
+            # Só árvores inteiras e totalmente concluídas são arquivadas, para não alterar o progresso de nenhum pai.
+            root_condition = ("parent_id IS NULL AND is_completed = 1 AND completed_at < ? "
+                              "AND subtree_done = subtree_total")
+            return self._move_to_archive(cursor, self._subtree_condition(root_condition), (cutoff,), "concluida")
+
+    def run_maintenance(self, older_than_days=ARCHIVE_AFTER_DAYS):
+        """
+        Arquiva tarefas antigas e compacta o banco aos poucos (incremental_vacuum + optimize).
+        Usa uma conexão própria, para que possa rodar em uma thread de segundo plano.
+        """
+        conn = self._connect()
+        try:
+            archived = self.archive_completed_tasks(older_than_days, conn)
+            with self._write_transaction(conn) as cursor:
+                self._snapshot_overdue(cursor)
+                cursor.execute("DELETE FROM open_by_due WHERE open_count = 0")
+            conn.execute(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})").fetchall()
+            conn.execute("PRAGMA optimize")
+        finally:
+            conn.close()
+        return archived
+
+    def get_archived_tasks(self, limit=100):
+        """Retorna as tarefas arquivadas mais recentes (o histórico continua consultável)."""
         cursor = self.conn.cursor()
-        cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-        self.conn.commit()
+        cursor.execute(f"""
+            SELECT id, title, archived_at, archive_reason FROM {self.archive_table}
+            ORDER BY archived_at DESC LIMIT ?
+        """, (limit,))
+        return [dict(row, title=self._open(row["title"], "title", row["id"])) for row in cursor.fetchall()]
+
+    def restore_task(self, task_id):
+        """Devolve uma tarefa arquivada (com as subtarefas arquivadas dela) para a lista ativa."""
+        with self._write_transaction() as cursor:
+            condition = self._subtree_condition("id = ?", self.archive_table)
+            cursor.execute(f"""
+                INSERT INTO tasks ({TASK_COLUMNS})
+                SELECT {TASK_COLUMNS} FROM {self.archive_table} WHERE {condition}
+            """, (task_id,))
+            cursor.execute(f"DELETE FROM {self.archive_table} WHERE {condition}", (task_id,))
+            self._recompute_subtree_counts(cursor, task_id)
+            self._refresh_scores(cursor, self._subtree_condition("id = ?"), (task_id,))
+            self._record_open(cursor, self._subtree_condition("id = ?"), (task_id,), 1)
+            row = cursor.execute("""
+                SELECT t.parent_id, t.is_completed, t.subtree_total, t.subtree_done, p.id AS active_parent
+                FROM tasks t LEFT JOIN tasks p ON p.id = t.parent_id WHERE t.id = ?
+            """, (task_id,)).fetchone()
+            if row is None:
+                return
+            if row["active_parent"] is None:
+                # O pai original não está mais ativo: a tarefa volta como raiz.
+                cursor.execute("UPDATE tasks SET parent_id = NULL WHERE id = ?", (task_id,))
+            else:
+                self._adjust_ancestors(cursor, row["parent_id"], 1 + row["subtree_total"],
+                                       row["is_completed"] + row["subtree_done"])
 
-    def get_all_categories(self):
-        """Retorna uma lista de todas as categorias únicas do banco de dados."""
+    def create_backup(self, directory=BACKUP_DIRECTORY, label=""):
+        """
+        Copia o banco (e o arquivo anexado, se houver) com a API de backup do SQLite, BACKUP_PAGES_PER_STEP
+        páginas por vez, usando uma conexão própria (pode rodar em uma thread de segundo plano). No modo WAL
+        a cópia lê um instantâneo fixo, sem bloquear quem grava. Com um banco de arquivo anexado (sem WAL)
+        os dois arquivos são copiados um depois do outro; se PRAGMA data_version mostrar que alguém gravou em
+        qualquer um deles nesse meio-tempo, o par é descartado e copiado de novo. A última de BACKUP_ATTEMPTS
+        tentativas segura a leitura dos dois arquivos e copia cada um de uma vez: o par sai consistente, mas
+        quem for gravar espera o fim dessa cópia. Os arquivos só aparecem com o nome final depois de
+        completos e verificados. Retorna o caminho do backup.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(directory, f"tasks-{stamp}{'-' + label if label else ''}")
+        schemas = [("main", base + ".db")]
+        if self.archive_db_filename:
+            schemas.append(("archive", base + "-arquivo.db"))
+        source = self._connect()
+        try:
+            if not self.archive_db_filename:
+                # Transação de leitura aberta durante toda a cópia: todos os passos veem o mesmo instantâneo.
+                source.execute("BEGIN")
+                source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                self._copy_database(source, "main", base + ".db.parcial")
+            for attempt in range(BACKUP_ATTEMPTS if self.archive_db_filename else 0):
+                last_attempt = attempt == BACKUP_ATTEMPTS - 1
+                if last_attempt:
+                    source.execute("BEGIN")
+                    source.execute("SELECT (SELECT COUNT(*) FROM main.sqlite_master) + (SELECT COUNT(*) FROM archive.sqlite_master)").fetchone()
+                versions = [source.execute(f"PRAGMA {schema}.data_version").fetchone()[0] for schema, _ in schemas]
+                for schema, path in schemas:
+                    self._copy_database(source, schema, path + ".parcial", pages=-1 if last_attempt else BACKUP_PAGES_PER_STEP)
+                if last_attempt or versions == [source.execute(f"PRAGMA {schema}.data_version").fetchone()[0] for schema, _ in schemas]:
+                    break
+        finally:
+            source.close()
+        for _, path in schemas:
+            os.replace(path + ".parcial", path)
+        return schemas[0][1]
+
+    @staticmethod
+    def _copy_database(source, schema, path, pages=BACKUP_PAGES_PER_STEP):
+        """Copia um schema da conexão 'source' para o arquivo 'path' (sobrescrevendo) e verifica a cópia."""
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target, pages=pages, name=schema, sleep=BACKUP_STEP_PAUSE_SECONDS)
+            target.execute("PRAGMA journal_mode = DELETE") # O backup é um arquivo único, sem -wal
+            if target.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+                raise sqlite3.DatabaseError(f"Backup corrompido: {path}")
+        finally:
+            target.close()
+
+    @staticmethod
+    def list_backups(directory=BACKUP_DIRECTORY):
+        """Retorna [(caminho, data)] dos backups do banco principal, do mais recente para o mais antigo."""
+        backups = []
+        for path in glob.glob(os.path.join(directory, "tasks-*.db")):
+            if path.endswith("-arquivo.db"):
+                continue
+            try:
+                taken_at = datetime.strptime(os.path.basename(path)[6:21], "%Y%m%d-%H%M%S")
+            except ValueError:
+                continue
+            backups.append((path, taken_at))
+        return sorted(backups, key=lambda backup: backup[1], reverse=True)
+
+    def prune_backups(self, directory=BACKUP_DIRECTORY, keep_last=BACKUP_KEEP_LAST, keep_daily=BACKUP_KEEP_DAILY):
+        """
+        Aplica a política de retenção: mantém os 'keep_last' backups mais recentes e o último de cada um dos
+        últimos 'keep_daily' dias; os demais (com o arquivo anexado correspondente) são apagados. Retorna quantos.
+        """
+        backups = self.list_backups(directory)
+        keep = {path for path, _ in backups[:keep_last]}
+        oldest_day = date.today() - timedelta(days=keep_daily - 1)
+        days_kept = set()
+        for path, taken_at in backups: # Do mais recente para o mais antigo: o primeiro de cada dia é o último feito nele
+            if taken_at.date() >= oldest_day and taken_at.date() not in days_kept:
+                days_kept.add(taken_at.date())
+                keep.add(path)
+        removed = 0
+        for path, _ in backups:
+            if path not in keep:
+                for file in (path, path[:-3] + "-arquivo.db"):
+                    if os.path.exists(file):
+                        os.remove(file)
+                removed += 1
+        return removed
+
+    def restore_backup(self, path, directory=BACKUP_DIRECTORY):
+        """
+        Substitui o conteúdo do banco (e do arquivo anexado) pelo de um backup. O backup é primeiro copiado
+        para uma área temporária e atualizado pelas migrações; depois todas as tabelas são trocadas em uma
+        única transação, que abrange os dois arquivos: as outras conexões veem o estado antigo ou o
+        restaurado, nunca uma mistura. Antes, o estado atual é salvo como um backup "pre-restauracao",
+        para que a restauração possa ser desfeita.
+        """
+        archive_path = path[:-3] + "-arquivo.db"
+        with tempfile.TemporaryDirectory() as staging_directory:
+            schemas = {"restauracao": ("main", os.path.join(staging_directory, "tasks.db"))}
+            if self.archive_db_filename:
+                schemas["restauracao_arquivo"] = ("archive", os.path.join(staging_directory, "arquivo.db"))
+            staging = self._stage_backup(path, archive_path, schemas)
+            try:
+                salt = staging.execute("SELECT value FROM settings WHERE key = 'encryption_salt'").fetchone()
+            finally:
+                staging.close()
+            current = self.conn.execute("SELECT value FROM settings WHERE key = 'encryption_salt'").fetchone()
+            if (salt and salt[0]) != (current and current["value"]):
+                raise ValueError("O backup foi feito com outra configuração de criptografia.")
+            self.create_backup(directory, label="pre-restauracao")
+
+            for alias, (_, staged_path) in schemas.items():
+                self.conn.execute("ATTACH DATABASE ? AS " + alias, (staged_path,))
+            try:
+                with self._write_transaction() as cursor:
+                    for alias, (schema, _) in schemas.items():
+                        self._replace_tables(cursor, schema, alias)
+                    if self.cipher:
+                        self._upgrade_legacy_encryption(cursor) # Backup anterior aos campos ligados à tarefa
+            finally:
+                for alias in schemas:
+                    self.conn.execute("DETACH DATABASE " + alias)
+        self.task_cache.validate(None)
+        self._check_ranking_weights()
+
+    def _stage_backup(self, path, archive_path, schemas):
+        """
+        Copia o backup para os arquivos temporários de 'schemas' e aplica as migrações pendentes (um backup de
+        uma versão anterior é atualizado como qualquer banco antigo). Retorna a conexão com a cópia.
+        """
+        for source_path, (schema, staged_path) in zip((path, archive_path), schemas.values()):
+            if not os.path.exists(source_path): # Backup sem arquivo anexado: o histórico fica vazio
+                continue
+            source = sqlite3.connect(source_path)
+            try:
+                self._copy_database(source, "main", staged_path)
+            finally:
+                source.close()
+        staging = sqlite3.connect(schemas["restauracao"][1])
+        staging.row_factory = sqlite3.Row
+        if self.archive_db_filename:
+            staging.execute("ATTACH DATABASE ? AS archive", (schemas["restauracao_arquivo"][1],))
+        version = staging.execute("PRAGMA user_version").fetchone()[0]
+        if version > self.SCHEMA_VERSION:
+            staging.close()
+            raise ValueError("O backup é de uma versão mais nova do aplicativo.")
+        with staging:
+            self._apply_migrations(staging.cursor(), version)
+        return staging
+
+    @staticmethod
+    def _replace_tables(cursor, schema, alias):
+        """Troca o conteúdo de cada tabela de 'schema' pelo da tabela de mesmo nome no banco anexado 'alias'."""
+        tables = [row[0] for row in cursor.execute(f"""
+            SELECT name FROM {schema}.sqlite_master
+            WHERE type = 'table' AND (name NOT LIKE 'sqlite_%' OR name = 'sqlite_sequence')
+        """).fetchall()]
+        staged = {row[0] for row in cursor.execute(f"SELECT name FROM {alias}.sqlite_master WHERE type = 'table'")}
+        for table in tables:
+            cursor.execute(f"DELETE FROM {schema}.{table}")
+            if table in staged:
+                # Colunas pelo nome: a ordem pode variar entre bancos migrados por caminhos diferentes.
+                columns = ", ".join(row[1] for row in cursor.execute(f"PRAGMA {schema}.table_info({table})").fetchall())
+                cursor.execute(f"INSERT INTO {schema}.{table} ({columns}) SELECT {columns} FROM {alias}.{table}")
+
+    def get_all_tags(self):
+        """Retorna, em ordem alfabética, as tags usadas por ao menos uma tarefa ativa."""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT DISTINCT category FROM tasks WHERE category IS NOT NULL AND category != ''")
-        categories = {"Geral"}
-        for row in cursor.fetchall():
-            categories.add(row[0])
-        return sorted(list(categories))
+        cursor.execute("""
+            SELECT name FROM tags WHERE EXISTS (
+                SELECT 1 FROM task_tags tt JOIN tasks t ON t.id = tt.task_id WHERE tt.tag_id = tags.id
+            ) ORDER BY name
+        """)
+        return [row["name"] for row in cursor.fetchall()]
+
+    def get_tag_weights(self):
+        """Retorna [(tag, peso)] das tags usadas por ao menos uma tarefa ativa, em ordem alfabética."""
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT name, weight FROM tags WHERE EXISTS (
+                SELECT 1 FROM task_tags tt JOIN tasks t ON t.id = tt.task_id WHERE tt.tag_id = tags.id
+            ) ORDER BY name
+        """)
+        return [(row["name"], row["weight"]) for row in cursor.fetchall()]
 
     def close_connection(self):
-        """Fecha a conexão com o banco de dados."""
-        if self.conn:
-            self.conn.close()
+        """Fecha as conexões com o banco de dados (de todas as threads)."""
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
 
 
 class App(ctk.CTk):
@@ -109,7 +1379,20 @@ class App(ctk.CTk):
     def __init__(self, task_manager):
         super().__init__()
         self.task_manager = task_manager
-        self.current_filter = "Todas"
+        self.include_tags, self.exclude_tags = [], []
+        self.view_mode = "Lista"
+        self.first_completed_root_frame = None
+        self.page_root_count = 0 # Tarefas raiz na página exibida (ver _show_new_tasks)
+        # Paginação: chaves de início das páginas já visitadas (para voltar) e a da próxima página.
+        self.page_keys = [None]
+        self.next_page_key = None
+        self.expanded_ids = set()
+        # O mesmo para os filhos de cada nó expandido: {id_do_pai: [chaves de início]} e {id_do_pai: próxima chave}.
+        self.child_page_keys = {}
+        self.next_child_keys = {}
+        self.maintenance_thread = None
+        self.archived_in_background = 0
+        self.backup_thread = None
 
         # --- Configurações da Janela Principal ---
         self.title("Gerenciador de Tarefas com SQLite")
@@ -127,12 +1410,23 @@ class App(ctk.CTk):
 
         # --- Inicialização ---
         self.refresh_ui()
+        self.bind("<Control-n>", lambda event: self.quick_add_textbox.focus())
         self.protocol("WM_DELETE_WINDOW", self.on_closing)
+        self.after(5000, self.start_background_maintenance)
+        self.after(BACKUP_INTERVAL_MS, self.start_background_backup)
 
     def _create_input_frame(self):
-        frame = ctk.CTkFrame(self)
+        frame = ctk.CTkScrollableFrame(self)
         frame.grid(row=0, column=0, padx=20, pady=20, sticky="nsew")
         
+        ctk.CTkLabel(frame, text="Adição Rápida", font=ctk.CTkFont(size=20, weight="bold")).pack(padx=20, pady=(20, 5), anchor="w")
+        ctk.CTkLabel(frame, text="Uma tarefa por linha: Título !alta @tag ^AAAA-MM-DD *semanal\nCtrl+Enter adiciona todas (Ctrl+N volta para cá).",
+                     font=ctk.CTkFont(size=11), text_color="gray50", justify="left").pack(padx=20, anchor="w")
+        self.quick_add_textbox = ctk.CTkTextbox(frame, height=70)
+        self.quick_add_textbox.pack(fill="x", padx=20, pady=5)
+        self.quick_add_textbox.bind("<Control-Return>", self.quick_add_callback)
+        ctk.CTkButton(frame, text="Adicionar Linhas", command=self.quick_add_callback).pack(padx=20, pady=(0, 10), fill="x")
+
         ctk.CTkLabel(frame, text="Nova Tarefa", font=ctk.CTkFont(size=20, weight="bold")).pack(padx=20, pady=(20, 10), anchor="w")
         
         self.title_entry = ctk.CTkEntry(frame, placeholder_text="Título da tarefa")
@@ -151,15 +1445,42 @@ class App(ctk.CTk):
         self.due_date_entry = ctk.CTkEntry(frame, placeholder_text="Opcional")
         self.due_date_entry.pack(fill="x", padx=20, pady=5)
 
-        ctk.CTkLabel(frame, text="Categoria:").pack(padx=20, pady=(10, 0), anchor="w")
-        self.category_entry = ctk.CTkEntry(frame, placeholder_text="Ex: Trabalho, Pessoal")
-        self.category_entry.pack(fill="x", padx=20, pady=5)
+        ctk.CTkLabel(frame, text="Tags (separadas por vírgula):").pack(padx=20, pady=(10, 0), anchor="w")
+        self.tags_entry = ctk.CTkEntry(frame, placeholder_text="Ex: Trabalho, Urgente")
+        self.tags_entry.pack(fill="x", padx=20, pady=5)
+
+        self.recurrence_menu, self.recurrence_every_entry = self._create_recurrence_inputs(frame)
 
         add_button = ctk.CTkButton(frame, text="Adicionar Tarefa", command=self.add_task_callback)
         add_button.pack(padx=20, pady=20, fill="x")
 
         return frame
 
+    def _create_recurrence_inputs(self, parent, recurrence=None):
+        ctk.CTkLabel(parent, text="Repetição:").pack(padx=20, pady=(10, 0), anchor="w")
+        recurrence_frame = ctk.CTkFrame(parent, fg_color="transparent")
+        recurrence_frame.pack(fill="x", padx=20, pady=5)
+        recurrence_menu = ctk.CTkComboBox(recurrence_frame, values=["Não repete"] + list(RECURRENCE_LABELS.values()))
+        recurrence_menu.pack(side="left", fill="x", expand=True)
+        ctk.CTkLabel(recurrence_frame, text="a cada").pack(side="left", padx=5)
+        every_entry = ctk.CTkEntry(recurrence_frame, width=50)
+        every_entry.pack(side="left")
+        frequency, every = recurrence or (None, 1)
+        recurrence_menu.set(RECURRENCE_LABELS.get(frequency, "Não repete"))
+        every_entry.insert(0, str(every))
+        return recurrence_menu, every_entry
+
+    def _read_recurrence(self, recurrence_menu, every_entry):
+        """Lê a regra de repetição dos campos; levanta ValueError se o intervalo não for um inteiro positivo."""
+        codes = {label: code for code, label in RECURRENCE_LABELS.items()}
+        frequency = codes.get(recurrence_menu.get())
+        if frequency is None:
+            return None
+        every = int(every_entry.get().strip() or 1)
+        if every < 1:
+            raise ValueError(every)
+        return (frequency, every)
+
     def _create_tasks_display_frame(self):
         frame = ctk.CTkFrame(self)
         frame.grid(row=0, column=1, padx=(0, 20), pady=20, sticky="nsew")
@@ -171,64 +1492,162 @@ class App(ctk.CTk):
         header_frame.grid_columnconfigure(0, weight=1)
         
         ctk.CTkLabel(header_frame, text="Minhas Tarefas", font=ctk.CTkFont(size=20, weight="bold")).grid(row=0, column=0, sticky="w")
+        self.view_selector = ctk.CTkSegmentedButton(header_frame, values=["Lista", "Próximas"], command=self.change_view_callback)
+        self.view_selector.set(self.view_mode)
+        self.view_selector.grid(row=0, column=1, padx=10, sticky="e")
+        ctk.CTkButton(header_frame, text="Estatísticas", width=100, command=self.open_dashboard_window).grid(row=0, column=2, padx=(0, 10), sticky="e")
+        ctk.CTkButton(header_frame, text="Ver Arquivo", width=100, command=self.open_archive_window).grid(row=0, column=3, sticky="e")
+        ctk.CTkButton(header_frame, text="Backups", width=80, command=self.open_backup_window).grid(row=0, column=4, padx=(10, 0), sticky="e")
         
-        ctk.CTkLabel(header_frame, text="Filtrar por Categoria:").grid(row=1, column=0, pady=(10,0), sticky="w")
-        self.filter_menu = ctk.CTkComboBox(header_frame, command=self.filter_tasks_callback)
-        self.filter_menu.grid(row=2, column=0, sticky="w")
+        ctk.CTkLabel(header_frame, text="Filtrar por Tags (ex: trabalho urgente -pessoal):").grid(row=1, column=0, pady=(10,0), sticky="w")
+        filter_frame = ctk.CTkFrame(header_frame, fg_color="transparent")
+        filter_frame.grid(row=2, column=0, columnspan=5, sticky="ew")
+        filter_frame.grid_columnconfigure(0, weight=1)
+        self.filter_entry = ctk.CTkEntry(filter_frame, placeholder_text="Todas as tarefas")
+        self.filter_entry.grid(row=0, column=0, sticky="ew")
+        self.filter_entry.bind("<Return>", lambda event: self.filter_tasks_callback())
+        self.filter_menu = ctk.CTkComboBox(filter_frame, width=150, command=self.add_tag_to_filter_callback)
+        self.filter_menu.grid(row=0, column=1, padx=(10, 0))
+        ctk.CTkButton(filter_frame, text="Limpar", width=60, command=self.clear_filter_callback).grid(row=0, column=2, padx=(10, 0))
+        ctk.CTkButton(filter_frame, text="Pesos", width=60, command=self.open_tag_weights_window).grid(row=0, column=3, padx=(10, 0))
         
         self.scrollable_frame = ctk.CTkScrollableFrame(frame, label_text="")
         self.scrollable_frame.grid(row=2, column=0, padx=20, pady=10, sticky="nsew")
+
+        page_frame = ctk.CTkFrame(frame, fg_color="transparent")
+        page_frame.grid(row=3, column=0, padx=20, pady=(0, 10))
+        self.previous_page_button = ctk.CTkButton(page_frame, text="◀ Anterior", width=100, command=self.previous_page_callback)
+        self.previous_page_button.grid(row=0, column=0)
+        self.page_label = ctk.CTkLabel(page_frame, text="Página 1", width=100)
+        self.page_label.grid(row=0, column=1, padx=10)
+        self.next_page_button = ctk.CTkButton(page_frame, text="Próxima ▶", width=100, command=self.next_page_callback)
+        self.next_page_button.grid(row=0, column=2)
         
         return frame
 
     def refresh_ui(self):
-        self.update_category_filter()
+        self.update_tag_filter()
         self.refresh_tasks_display()
 
-    def update_category_filter(self):
-        categories = ["Todas"] + self.task_manager.get_all_categories()
-        self.filter_menu.configure(values=categories)
-        if self.current_filter not in categories:
-            self.current_filter = "Todas"
-        self.filter_menu.set(self.current_filter)
+    def update_tag_filter(self):
+        self.filter_menu.configure(values=self.task_manager.get_all_tags())
+        self.filter_menu.set("+ Tag")
 
     def refresh_tasks_display(self):
         for widget in self.scrollable_frame.winfo_children():
             widget.destroy()
 
-        all_tasks = self.task_manager.get_all_tasks()
-        
-        tasks_to_show = all_tasks
-        if self.current_filter != "Todas":
-            tasks_to_show = [task for task in all_tasks if task.category == self.current_filter]
+        self.next_page_key, self.next_child_keys = None, {}
+        if self.view_mode == "Próximas":
+            # Ranking já ordenado pelo índice de pontuação; o filtro de tags não se aplica a esta visão.
+            rows = [(task, 0) for task in self.task_manager.get_next_tasks()]
+        elif not self.include_tags and not self.exclude_tags:
+            # Árvore: só as subárvores expandidas são buscadas no banco.
+            child_after = {parent_id: keys[-1] for parent_id, keys in self.child_page_keys.items()}
+            rows, self.next_page_key, self.next_child_keys = self.task_manager.get_visible_tree(
+                self.expanded_ids, after=self.page_keys[-1], child_after=child_after)
+        else:
+            tasks, self.next_page_key = self.task_manager.get_tasks_by_tags(self.include_tags, self.exclude_tags, after=self.page_keys[-1])
+            rows = [(task, 0) for task in tasks]
+        if not rows and len(self.page_keys) > 1:
+            # A página ficou vazia (ex.: última tarefa dela excluída): volta para a anterior.
+            self.page_keys.pop()
+            self.refresh_tasks_display()
+            return
+        self._update_page_controls()
+
+        self.first_completed_root_frame = None
+        self.page_root_count = sum(1 for _, depth in rows if depth == 0)
+        open_parents = [] # Nós expandidos cujo bloco de filhos ainda não terminou, com a profundidade
+        for task, depth in rows:
+            while open_parents and open_parents[-1][1] >= depth:
+                self._create_child_pager(*open_parents.pop())
+            task_frame = self.create_task_widget(task, depth)
+            if depth == 0 and task.is_completed and self.first_completed_root_frame is None:
+                self.first_completed_root_frame = task_frame
+            if task.id in self.expanded_ids:
+                open_parents.append((task.id, depth))
+        while open_parents:
+            self._create_child_pager(*open_parents.pop())
 
-        sorted_tasks = sorted(tasks_to_show, key=lambda t: t.is_completed)
+    def _create_child_pager(self, parent_id, depth):
+        """Linha "anteriores / mais subtarefas" ao fim dos filhos de um nó que tem mais de uma página deles."""
+        has_previous = len(self.child_page_keys.get(parent_id, [None])) > 1
+        if not has_previous and parent_id not in self.next_child_keys:
+            return
+        pager_frame = ctk.CTkFrame(self.scrollable_frame, fg_color="transparent")
+        pager_frame.pack(fill="x", padx=(5 + 25 * (depth + 1), 5), pady=(0, 5))
+        if has_previous:
+            ctk.CTkButton(pager_frame, text="◀ Subtarefas anteriores", width=160,
+                          command=lambda: self.child_page_callback(parent_id, forward=False)).pack(side="left")
+        if parent_id in self.next_child_keys:
+            ctk.CTkButton(pager_frame, text="Mais subtarefas ▶", width=160,
+                          command=lambda: self.child_page_callback(parent_id, forward=True)).pack(side="left", padx=(10, 0))
 
-        for task in sorted_tasks:
-            self.create_task_widget(task)
+    def _update_page_controls(self):
+        paged = self.view_mode != "Próximas"
+        self.previous_page_button.configure(state="normal" if paged and len(self.page_keys) > 1 else "disabled")
+        self.next_page_button.configure(state="normal" if paged and self.next_page_key else "disabled")
+        self.page_label.configure(text=f"Página {len(self.page_keys)}" if paged else "")
 
-    def create_task_widget(self, task):
+    def _reset_pages(self):
+        self.page_keys = [None]
+
+    def _show_new_tasks(self, task_ids):
+        """
+        Exibe tarefas recém-criadas sem redesenhar a lista: na árvore, novas tarefas raiz pendentes ficam
+        logo antes da primeira tarefa concluída. Nas outras visões, ou se a página passaria de PAGE_SIZE
+        tarefas raiz, a lista é recarregada uma única vez.
+        """
+        self.update_tag_filter()
+        if (self.view_mode != "Lista" or self.include_tags or self.exclude_tags
+                or self.page_root_count + len(task_ids) > PAGE_SIZE):
+            self.refresh_tasks_display()
+            return
+        if self.first_completed_root_frame is None and self.next_page_key is not None:
+            return # As pendentes continuam em outra página: a nova tarefa aparece lá.
+        for task in self.task_manager.get_tasks(task_ids):
+            self.create_task_widget(task, before=self.first_completed_root_frame)
+            self.page_root_count += 1
+
+    def create_task_widget(self, task, depth=0, before=None):
         PRIORITY_COLORS = {"Alta": "#D32F2F", "Média": "#FFA000", "Baixa": "#1976D2"}
         task_frame = ctk.CTkFrame(self.scrollable_frame)
-        task_frame.pack(fill="x", padx=5, pady=5)
+        pack_options = {"before": before} if before is not None else {}
+        task_frame.pack(fill="x", padx=(5 + 25 * depth, 5), pady=5, **pack_options)
         task_frame.grid_columnconfigure(1, weight=1)
         
         priority_indicator = ctk.CTkFrame(task_frame, width=10, fg_color=PRIORITY_COLORS.get(task.priority, "grey"))
         priority_indicator.grid(row=0, column=0, rowspan=3, sticky="ns", padx=(5,0), pady=5)
         
+        title_frame = ctk.CTkFrame(task_frame, fg_color="transparent")
+        title_frame.grid(row=0, column=1, padx=10, pady=(10, 0), sticky="w")
+        if task.has_subtasks:
+            expand_button = ctk.CTkButton(title_frame, text="▾" if task.id in self.expanded_ids else "▸", width=24,
+                                          fg_color="transparent", command=lambda t=task: self.toggle_expand_callback(t))
+            expand_button.pack(side="left", padx=(0, 5))
+
         check_var = ctk.StringVar(value="on" if task.is_completed else "off")
         font_style = ctk.CTkFont(size=14, weight="bold", slant="italic" if task.is_completed else "roman")
         checkbox = ctk.CTkCheckBox(
-            task_frame, text=task.title, variable=check_var, font=font_style,
+            title_frame, text=task.title, variable=check_var, font=font_style,
             command=lambda t=task: self.toggle_complete_callback(t)
         )
-        checkbox.grid(row=0, column=1, padx=10, pady=(10, 0), sticky="w")
+        checkbox.pack(side="left")
         
         if task.description:
-            desc_label = ctk.CTkLabel(task_frame, text=task.description, wraplength=500, justify="left", font=ctk.CTkFont(size=12))
-            desc_label.grid(row=1, column=1, padx=20, pady=(0, 5), sticky="w")
+            # Só a prévia é desenhada; o texto completo é lido do banco quando o usuário pede.
+            desc_frame = ctk.CTkFrame(task_frame, fg_color="transparent")
+            desc_frame.grid(row=1, column=1, padx=20, pady=(0, 5), sticky="w")
+            desc_label = ctk.CTkLabel(desc_frame, text=task.description_preview, wraplength=500, justify="left", font=ctk.CTkFont(size=12))
+            desc_label.pack(anchor="w")
+            if task.description_preview != task.description or task.description_truncated:
+                more_button = ctk.CTkButton(desc_frame, text="Mostrar mais", width=90, height=20, fg_color="transparent",
+                                            text_color=("gray20", "gray80"), font=ctk.CTkFont(size=11))
+                more_button.configure(command=lambda t=task, l=desc_label, b=more_button: self.expand_description_callback(t, l, b))
+                more_button.pack(anchor="w")
 
-        info_text = f"Categoria: {task.category}"
+        info_text = f"Tags: {', '.join(task.tags)}" if task.tags else "Sem tags"
         is_overdue = False
         if task.due_date:
             try:
@@ -238,6 +1657,13 @@ class App(ctk.CTk):
                     is_overdue = True
                 info_text += f"  |  Vencimento: {due_date_str}"
             except (ValueError, TypeError): pass
+        if task.recurrence:
+            frequency, every = task.recurrence
+            upcoming = [d.strftime("%d/%m") for d in self.task_manager.get_occurrences(task)][:4]
+            info_text += f"  |  Repete: {RECURRENCE_LABELS[frequency]}" + (f" (a cada {every})" if every > 1 else "")
+            if upcoming: info_text += f" - próximas: {', '.join(upcoming)}"
+        if task.has_subtasks:
+            info_text += f"  |  Subtarefas: {task.subtree_done}/{task.subtree_total} ({task.progress}%)"
         
         info_label = ctk.CTkLabel(task_frame, text=info_text, font=ctk.CTkFont(size=11), text_color="gray50")
         info_label.grid(row=2, column=1, padx=10, pady=(0, 10), sticky="w")
@@ -247,6 +1673,8 @@ class App(ctk.CTk):
         
         edit_button = ctk.CTkButton(action_frame, text="Editar", width=60, command=lambda t=task: self.open_edit_window(t))
         edit_button.pack(pady=2)
+        subtask_button = ctk.CTkButton(action_frame, text="+ Sub", width=60, command=lambda t=task: self.add_subtask_callback(t))
+        subtask_button.pack(pady=2)
         delete_button = ctk.CTkButton(action_frame, text="Excluir", width=60, fg_color="#D32F2F", hover_color="#B71C1C", command=lambda t=task: self.delete_task_callback(t))
         delete_button.pack(pady=2)
         
@@ -254,44 +1682,139 @@ class App(ctk.CTk):
         if is_overdue:
             task_frame.configure(border_width=2, border_color="#D32F2F")
             info_label.configure(text_color="#D32F2F", font=ctk.CTkFont(size=11, weight="bold"))
+        return task_frame
+
+    def quick_add_callback(self, event=None):
+        entries, errors, failed_lines = [], [], []
+        for number, line in enumerate(self.quick_add_textbox.get("1.0", "end-1c").splitlines(), start=1):
+            if not line.strip(): continue
+            try: entries.append(parse_quick_add(line))
+            except ValueError as error:
+                errors.append(f"Linha {number}: {error}"); failed_lines.append(line)
+
+        if entries:
+            # Uma transação para todas as linhas e uma única atualização da lista.
+            self._show_new_tasks(self.task_manager.add_tasks(entries))
+        # As linhas com erro ficam na caixa para serem corrigidas.
+        self.quick_add_textbox.delete("1.0", "end")
+        self.quick_add_textbox.insert("1.0", "\n".join(failed_lines))
+        if errors:
+            messagebox.showwarning("Adição Rápida", "\n".join(errors))
+        return "break" # Impede que o Ctrl+Enter insira uma quebra de linha
 
     def add_task_callback(self):
         title = self.title_entry.get().strip()
         description = self.desc_textbox.get("1.0", "end-1c").strip()
         priority = self.priority_menu.get()
         due_date = self.due_date_entry.get().strip() or None
-        category = self.category_entry.get().strip() or "Geral"
+        tags = parse_tags(self.tags_entry.get())
 
         if not title: messagebox.showwarning("Campo Vazio", "O título da tarefa é obrigatório."); return
         if due_date:
             try: datetime.strptime(due_date, "%Y-%m-%d")
             except ValueError: messagebox.showerror("Formato Inválido", "A data deve estar no formato AAAA-MM-DD."); return
+        try: recurrence = self._read_recurrence(self.recurrence_menu, self.recurrence_every_entry)
+        except ValueError: messagebox.showerror("Formato Inválido", "O intervalo de repetição deve ser um número inteiro positivo."); return
 
-        self.task_manager.add_task(title, description, priority, due_date, category)
-        self.refresh_ui()
+        task_id = self.task_manager.add_task(title, description, priority, due_date, tags, recurrence=recurrence)
+        self._show_new_tasks([task_id])
         
         self.title_entry.delete(0, "end"); self.desc_textbox.delete("1.0", "end")
-        self.due_date_entry.delete(0, "end"); self.category_entry.delete(0, "end")
+        self.due_date_entry.delete(0, "end"); self.tags_entry.delete(0, "end")
+        self.recurrence_menu.set("Não repete")
         self.title_entry.focus()
         
+    def add_subtask_callback(self, parent):
+        dialog = ctk.CTkInputDialog(text=f"Título da subtarefa de '{parent.title}':", title="Nova Subtarefa")
+        title = (dialog.get_input() or "").strip()
+        if not title: return
+        self.task_manager.add_task(title, "", parent.priority, None, parent.tags, parent_id=parent.id)
+        self.expanded_ids.add(parent.id)
+        self.refresh_tasks_display()
+
+    def expand_description_callback(self, task, desc_label, more_button):
+        desc_label.configure(text=self.task_manager.load_description(task))
+        more_button.destroy()
+
+    def toggle_expand_callback(self, task):
+        self.expanded_ids.symmetric_difference_update({task.id})
+        self.child_page_keys.pop(task.id, None)
+        self.refresh_tasks_display()
+
+    def child_page_callback(self, parent_id, forward):
+        keys = self.child_page_keys.setdefault(parent_id, [None])
+        if forward:
+            keys.append(self.next_child_keys[parent_id])
+        elif len(keys) > 1:
+            keys.pop()
+        if keys == [None]:
+            del self.child_page_keys[parent_id]
+        self.refresh_tasks_display()
+
     def delete_task_callback(self, task):
-        if messagebox.askyesno("Confirmar Exclusão", f"Tem certeza que deseja excluir a tarefa '{task.title}'?"):
+        question = f"Tem certeza que deseja excluir a tarefa '{task.title}'?"
+        if task.has_subtasks:
+            question = f"Tem certeza que deseja excluir a tarefa '{task.title}' e suas {task.subtree_total} subtarefas?"
+        if messagebox.askyesno("Confirmar Exclusão", question):
             self.task_manager.delete_task(task.id)
+            self.expanded_ids.discard(task.id)
+            self.child_page_keys.pop(task.id, None)
             self.refresh_ui()
 
     def toggle_complete_callback(self, task):
         task.is_completed = not task.is_completed
-        self.task_manager.update_task(task)
+        if not self.task_manager.update_task(task):
+            self.show_task_gone()
+            return
         self.refresh_tasks_display()
+
+    def show_task_gone(self, parent=None):
+        """Avisa que a tarefa foi arquivada ou excluída enquanto estava na tela e recarrega a lista."""
+        messagebox.showwarning("Tarefa Indisponível", "Esta tarefa não existe mais: foi arquivada ou excluída.",
+                               parent=parent or self)
+        self.refresh_ui()
     
-    def filter_tasks_callback(self, selected_category):
-        self.current_filter = selected_category
+    def filter_tasks_callback(self):
+        # "tag" exige a tag; "-tag" (ou "!tag") exclui as tarefas que a possuem.
+        include, exclude = [], []
+        for token in self.filter_entry.get().replace(",", " ").split():
+            if token[0] in "-!":
+                exclude += parse_tags(token[1:])
+            else:
+                include += parse_tags(token)
+        self.include_tags, self.exclude_tags = include, exclude
+        self._reset_pages()
         self.refresh_tasks_display()
 
+    def change_view_callback(self, view_mode):
+        self.view_mode = view_mode
+        self._reset_pages()
+        self.refresh_tasks_display()
+
+    def next_page_callback(self):
+        if self.next_page_key:
+            self.page_keys.append(self.next_page_key)
+            self.refresh_tasks_display()
+
+    def previous_page_callback(self):
+        if len(self.page_keys) > 1:
+            self.page_keys.pop()
+            self.refresh_tasks_display()
+
+    def add_tag_to_filter_callback(self, tag):
+        self.filter_entry.insert("end", f" {tag}" if self.filter_entry.get().strip() else tag)
+        self.filter_menu.set("+ Tag")
+        self.filter_tasks_callback()
+
+    def clear_filter_callback(self):
+        self.filter_entry.delete(0, "end")
+        self.filter_tasks_callback()
+
     def open_edit_window(self, task):
         edit_window = ctk.CTkToplevel(self)
         edit_window.title("Editar Tarefa")
-        edit_window.geometry("400x450"); edit_window.transient(self); edit_window.grab_set()
+        edit_window.geometry("400x540"); edit_window.transient(self); edit_window.grab_set()
+        self.task_manager.load_description(task)
         
         ctk.CTkLabel(edit_window, text="Título:").pack(padx=20, pady=(10,0), anchor="w")
         title_entry = ctk.CTkEntry(edit_window); title_entry.pack(fill="x", padx=20, pady=5); title_entry.insert(0, task.title)
@@ -306,26 +1829,229 @@ class App(ctk.CTk):
         due_date_entry = ctk.CTkEntry(edit_window); due_date_entry.pack(fill="x", padx=20, pady=5)
         if task.due_date: due_date_entry.insert(0, task.due_date)
 
-        ctk.CTkLabel(edit_window, text="Categoria:").pack(padx=20, pady=(10,0), anchor="w")
-        category_entry = ctk.CTkEntry(edit_window); category_entry.pack(fill="x", padx=20, pady=5); category_entry.insert(0, task.category)
+        ctk.CTkLabel(edit_window, text="Tags (separadas por vírgula):").pack(padx=20, pady=(10,0), anchor="w")
+        tags_entry = ctk.CTkEntry(edit_window); tags_entry.pack(fill="x", padx=20, pady=5); tags_entry.insert(0, ", ".join(task.tags))
+
+        recurrence_menu, every_entry = self._create_recurrence_inputs(edit_window, task.recurrence)
 
         def save_changes():
             new_title = title_entry.get().strip()
             if not new_title: messagebox.showerror("Erro", "O título não pode ficar vazio.", parent=edit_window); return
+            new_due_date = due_date_entry.get().strip() or None
+            if new_due_date:
+                try: datetime.strptime(new_due_date, "%Y-%m-%d")
+                except ValueError: messagebox.showerror("Formato Inválido", "A data deve estar no formato AAAA-MM-DD.", parent=edit_window); return
+            try: recurrence = self._read_recurrence(recurrence_menu, every_entry)
+            except ValueError: messagebox.showerror("Formato Inválido", "O intervalo de repetição deve ser um número inteiro positivo.", parent=edit_window); return
             
             task.title = new_title
             task.description = desc_box.get("1.0", "end-1c").strip()
             task.priority = priority_menu.get()
-            task.due_date = due_date_entry.get().strip() or None
-            task.category = category_entry.get().strip() or "Geral"
+            task.due_date = new_due_date
+            task.tags = parse_tags(tags_entry.get())
+            task.recurrence = recurrence
             
-            self.task_manager.update_task(task)
+            if not self.task_manager.update_task(task):
+                self.show_task_gone(parent=edit_window)
+                edit_window.destroy()
+                return
             edit_window.destroy()
             self.refresh_ui()
 
         save_button = ctk.CTkButton(edit_window, text="Salvar Alterações", command=save_changes)
         save_button.pack(padx=20, pady=20)
 
+    def open_archive_window(self):
+        archive_window = ctk.CTkToplevel(self)
+        archive_window.title("Tarefas Arquivadas")
+        archive_window.geometry("600x500"); archive_window.transient(self)
+
+        archive_frame = ctk.CTkScrollableFrame(archive_window, label_text="Histórico (mais recentes primeiro)")
+        archive_frame.pack(fill="both", expand=True, padx=20, pady=20)
+
+        def restore(task_id, row_frame):
+            self.task_manager.restore_task(task_id)
+            row_frame.destroy()
+            self.refresh_ui()
+
+        for row in self.task_manager.get_archived_tasks():
+            row_frame = ctk.CTkFrame(archive_frame)
+            row_frame.pack(fill="x", padx=5, pady=3)
+            row_frame.grid_columnconfigure(0, weight=1)
+            reason = "Concluída" if row["archive_reason"] == "concluida" else "Excluída"
+            ctk.CTkLabel(row_frame, text=row["title"], font=ctk.CTkFont(size=13, weight="bold")).grid(row=0, column=0, padx=10, sticky="w")
+            ctk.CTkLabel(row_frame, text=f"{reason} | Arquivada em: {row['archived_at'][:10]}", font=ctk.CTkFont(size=11),
+                         text_color="gray50").grid(row=1, column=0, padx=10, pady=(0, 5), sticky="w")
+            ctk.CTkButton(row_frame, text="Restaurar", width=80,
+                          command=lambda i=row["id"], f=row_frame: restore(i, f)).grid(row=0, column=1, rowspan=2, padx=10)
+
+    def open_tag_weights_window(self):
+        weights_window = ctk.CTkToplevel(self)
+        weights_window.title("Pesos das Tags")
+        weights_window.geometry("350x450"); weights_window.transient(self); weights_window.grab_set()
+
+        ctk.CTkLabel(weights_window, text="Pontos somados à pontuação das tarefas\ncom a tag na visão \"Próximas\".",
+                     justify="left").pack(padx=20, pady=(20, 5), anchor="w")
+        weights_frame = ctk.CTkScrollableFrame(weights_window)
+        weights_frame.pack(fill="both", expand=True, padx=20, pady=5)
+        weights_frame.grid_columnconfigure(0, weight=1)
+        entries = {}
+        for row, (tag, weight) in enumerate(self.task_manager.get_tag_weights()):
+            ctk.CTkLabel(weights_frame, text=tag).grid(row=row, column=0, padx=5, pady=3, sticky="w")
+            entry = ctk.CTkEntry(weights_frame, width=80)
+            entry.insert(0, f"{weight:g}")
+            entry.grid(row=row, column=1, padx=5, pady=3)
+            entries[tag] = (entry, weight)
+
+        def save_weights():
+            try:
+                new_weights = {tag: float(entry.get().replace(",", ".") or 0) for tag, (entry, _) in entries.items()}
+            except ValueError:
+                messagebox.showerror("Erro", "Os pesos devem ser números (ex: 10 ou -5,5).", parent=weights_window)
+                return
+            for tag, weight in new_weights.items():
+                if weight != entries[tag][1]: # Só as tarefas das tags alteradas são repontuadas
+                    self.task_manager.set_tag_weight(tag, weight)
+            self.refresh_tasks_display()
+            weights_window.destroy()
+
+        ctk.CTkButton(weights_window, text="Salvar Pesos", command=save_weights).pack(padx=20, pady=(5, 20), fill="x")
+
+    def open_backup_window(self):
+        backup_window = ctk.CTkToplevel(self)
+        backup_window.title("Backups")
+        backup_window.geometry("500x450"); backup_window.transient(self)
+
+        status_label = ctk.CTkLabel(backup_window, text=f"Pasta: {os.path.abspath(BACKUP_DIRECTORY)}", text_color="gray50")
+        status_label.pack(padx=20, pady=(20, 5), anchor="w")
+        backup_frame = ctk.CTkScrollableFrame(backup_window, label_text="Backups (mais recentes primeiro)")
+
+        def fill():
+            for widget in backup_frame.winfo_children():
+                widget.destroy()
+            for path, taken_at in self.task_manager.list_backups():
+                row_frame = ctk.CTkFrame(backup_frame)
+                row_frame.pack(fill="x", padx=5, pady=3)
+                row_frame.grid_columnconfigure(0, weight=1)
+                ctk.CTkLabel(row_frame, text=taken_at.strftime("%d/%m/%Y %H:%M:%S"), font=ctk.CTkFont(size=13, weight="bold")).grid(row=0, column=0, padx=10, sticky="w")
+                ctk.CTkLabel(row_frame, text=os.path.basename(path), font=ctk.CTkFont(size=11), text_color="gray50").grid(row=1, column=0, padx=10, pady=(0, 5), sticky="w")
+                ctk.CTkButton(row_frame, text="Restaurar", width=80, command=lambda p=path: restore(p)).grid(row=0, column=1, rowspan=2, padx=10)
+
+        def restore(path):
+            if not messagebox.askyesno("Restaurar Backup", "Substituir todas as tarefas pelas do backup? O estado atual é salvo antes.", parent=backup_window):
+                return
+            try:
+                self.task_manager.restore_backup(path)
+            except (ValueError, sqlite3.Error) as error:
+                messagebox.showerror("Restaurar Backup", str(error), parent=backup_window)
+                return
+            self.expanded_ids.clear()
+            self.child_page_keys.clear()
+            self._reset_pages()
+            self.refresh_ui()
+            fill()
+
+        def backup_now():
+            self.start_background_backup(reschedule=False)
+            status_label.configure(text="Fazendo backup em segundo plano...")
+            self.after(1000, wait_for_backup)
+
+        def wait_for_backup():
+            if self.backup_thread.is_alive():
+                self.after(500, wait_for_backup)
+            elif backup_window.winfo_exists():
+                status_label.configure(text=f"Pasta: {os.path.abspath(BACKUP_DIRECTORY)}")
+                fill()
+
+        ctk.CTkButton(backup_window, text="Fazer Backup Agora", command=backup_now).pack(padx=20, pady=5, fill="x")
+        backup_frame.pack(fill="both", expand=True, padx=20, pady=(5, 20))
+        fill()
+
+    def open_dashboard_window(self):
+        stats = self.task_manager.get_statistics()
+        dashboard = ctk.CTkToplevel(self)
+        dashboard.title("Estatísticas")
+        dashboard.geometry("650x600"); dashboard.transient(self)
+        content = ctk.CTkScrollableFrame(dashboard)
+        content.pack(fill="both", expand=True, padx=20, pady=20)
+        content.grid_columnconfigure(1, weight=1)
+        title_font = ctk.CTkFont(size=16, weight="bold")
+
+        created = sum(day[1] for day in stats["daily"])
+        completed = sum(day[2] for day in stats["daily"])
+        rate = f"{round(100 * completed / created)}%" if created else "-"
+        summary = (f"Últimos {STATS_WINDOW_DAYS} dias: {created} criadas, {completed} concluídas (taxa: {rate})"
+                   f"  |  Atrasadas agora: {stats['overdue_now']}")
+        ctk.CTkLabel(content, text=summary, font=ctk.CTkFont(size=13, weight="bold")).grid(row=0, column=0, columnspan=3, sticky="w", pady=(0, 10))
+
+        row = 1
+        ctk.CTkLabel(content, text="Concluídas por dia", font=title_font).grid(row=row, column=0, columnspan=3, sticky="w", pady=(10, 5))
+        most = max((day[2] for day in stats["daily"]), default=0) or 1
+        for day, _, done in stats["daily"][-14:]:
+            row += 1
+            ctk.CTkLabel(content, text=date.fromisoformat(day).strftime("%d/%m")).grid(row=row, column=0, sticky="w", padx=(0, 10))
+            bar = ctk.CTkProgressBar(content); bar.set(done / most)
+            bar.grid(row=row, column=1, sticky="ew")
+            ctk.CTkLabel(content, text=str(done)).grid(row=row, column=2, padx=10)
+
+        row += 1
+        ctk.CTkLabel(content, text="Por semana (criadas / concluídas)", font=title_font).grid(row=row, column=0, columnspan=3, sticky="w", pady=(15, 5))
+        for week, week_created, week_done in stats["weekly"]:
+            row += 1
+            year, number = week.split("-")
+            ctk.CTkLabel(content, text=f"Semana {number}/{year}: {week_created} / {week_done}").grid(row=row, column=0, columnspan=3, sticky="w")
+
+        row += 1
+        ctk.CTkLabel(content, text="Por prioridade", font=title_font).grid(row=row, column=0, columnspan=3, sticky="w", pady=(15, 5))
+        for priority in ["Alta", "Média", "Baixa"] + sorted(set(stats["by_priority"]) - {"Alta", "Média", "Baixa"}):
+            if priority not in stats["by_priority"]: continue
+            values = stats["by_priority"][priority]
+            row += 1
+            ctk.CTkLabel(content, text=(f"{priority or 'Sem prioridade'}: {values['created']} criadas, {values['completed']} concluídas, "
+                                        f"{values['open']} pendentes, {values['overdue']} atrasadas")).grid(row=row, column=0, columnspan=3, sticky="w")
+
+        row += 1
+        ctk.CTkLabel(content, text="Evolução dos atrasos", font=title_font).grid(row=row, column=0, columnspan=3, sticky="w", pady=(15, 5))
+        trend = "  ".join(f"{date.fromisoformat(day).strftime('%d/%m')}: {count}" for day, count in stats["overdue_trend"][-10:])
+        ctk.CTkLabel(content, text=trend or "Sem histórico ainda.", wraplength=550, justify="left").grid(row=row + 1, column=0, columnspan=3, sticky="w")
+
+    def start_background_maintenance(self):
+        """Arquiva e compacta o banco em uma thread, sem travar a interface, e reagenda a próxima execução."""
+        if self.maintenance_thread is None or not self.maintenance_thread.is_alive():
+            self.maintenance_thread = threading.Thread(target=self._maintenance_worker, daemon=True)
+            self.maintenance_thread.start()
+            self.after(500, self._check_maintenance)
+        self.after(MAINTENANCE_INTERVAL_MS, self.start_background_maintenance)
+
+    def _maintenance_worker(self):
+        try:
+            self.archived_in_background = self.task_manager.run_maintenance()
+        except sqlite3.Error:
+            self.archived_in_background = 0 # Banco ocupado: tenta de novo na próxima rodada
+
+    def _check_maintenance(self):
+        # O Tkinter não é thread-safe: a thread só guarda o resultado e a interface é atualizada aqui.
+        if self.maintenance_thread.is_alive():
+            self.after(500, self._check_maintenance)
+        elif self.archived_in_background:
+            self.archived_in_background = 0
+            self.refresh_ui()
+
+    def start_background_backup(self, reschedule=True):
+        """Faz um backup a quente (e aplica a retenção) em uma thread; a interface e as gravações seguem livres."""
+        if self.backup_thread is None or not self.backup_thread.is_alive():
+            self.backup_thread = threading.Thread(target=self._backup_worker, daemon=True)
+            self.backup_thread.start()
+        if reschedule:
+            self.after(BACKUP_INTERVAL_MS, self.start_background_backup)
+
+    def _backup_worker(self):
+        try:
+            self.task_manager.create_backup()
+            self.task_manager.prune_backups()
+        except (OSError, sqlite3.Error):
+            pass # Disco cheio ou banco ocupado: tenta de novo na próxima rodada
+
     def on_closing(self):
         """Fecha a conexão com o DB antes de fechar a aplicação."""
         self.task_manager.close_connection()
@@ -333,6 +2059,10 @@ class App(ctk.CTk):
 
 # --- Ponto de Entrada da Aplicação ---
 if __name__ == "__main__":
-    task_manager = TaskManager()
+    try:
+        task_manager = TaskManager(passphrase=os.environ.get(PASSPHRASE_ENV_VAR))
+    except ValueError as error:
+        messagebox.showerror("Criptografia", str(error))
+        sys.exit(1)
     app = App(task_manager)
     app.mainloop()
\ No newline at end of file